@@ -0,0 +1,140 @@
+"""
+Measure how much each of our plugins adds to the startup time of every `tutor`
+command (including `tutor --help` and tab completion), and fail if any of them
+goes over budget.
+
+Each plugin is measured in fresh interpreters which have already imported Tutor's
+plugin API, like the Tutor CLI has by the time that it loads plugins:
+
+* import: the time to import the plugin's module, including everything that the
+  module imports.
+* registration: the time to run just the module's body again, with all of its
+  imports already cached. This is the cost of adding its hook callbacks and
+  defining its commands.
+
+The number of hook callbacks added by each plugin is reported as well.
+
+Usage:
+
+    python benchmarks/import_time.py [--runs N]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import typing as t
+
+# Budgets, in milliseconds. Each plugin takes a few milliseconds to import on a
+# typical laptop; these leave plenty of headroom for slower machines, while still
+# catching a module-level import of Jinja, the Docker API client's networking
+# modules, or Tutor's config & commands (each of which costs 20-200ms).
+IMPORT_BUDGETS_MS = {
+    "automountvenvs": 15,
+    "configdiff": 15,
+    "quickdev": 25,
+    "stopnightly": 15,
+}
+REGISTRATION_BUDGET_MS = 5
+
+# Runs within each fresh interpreter, and prints its measurements as JSON.
+MEASURE_SCRIPT = """
+import importlib
+import importlib.util
+import json
+import sys
+import time
+
+from tutor import hooks
+from tutor.core.hooks import actions, filters
+
+
+def count_callbacks():
+    return sum(
+        len(hook.callbacks)
+        for hook in [*filters.Filter.INDEX.values(), *actions.Action.INDEX.values()]
+    )
+
+
+module_name = sys.argv[1]
+callbacks_before = count_callbacks()
+start = time.perf_counter()
+importlib.import_module(module_name)
+import_time = time.perf_counter() - start
+callbacks = count_callbacks() - callbacks_before
+
+spec = importlib.util.find_spec(module_name)
+module = importlib.util.module_from_spec(spec)
+start = time.perf_counter()
+spec.loader.exec_module(module)
+registration_time = time.perf_counter() - start
+
+print(
+    json.dumps(
+        {
+            "import_ms": import_time * 1000,
+            "registration_ms": registration_time * 1000,
+            "callbacks": callbacks,
+        }
+    )
+)
+"""
+
+
+def measure(plugin: str, runs: int) -> dict[str, t.Any]:
+    """
+    Measure a plugin in `runs` fresh interpreters, and keep the fastest times.
+    """
+    env = dict(os.environ)
+    # Otherwise, every run would pay for compiling the plugin's source.
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    results = []
+    # The first run only writes bytecode.
+    for _run in range(runs + 1):
+        output = subprocess.check_output(
+            [sys.executable, "-c", MEASURE_SCRIPT, f"tutorkdmccormick.{plugin}"],
+            env=env,
+        )
+        results.append(json.loads(output))
+    results = results[1:]
+    return {
+        "import_ms": min(result["import_ms"] for result in results),
+        "registration_ms": min(result["registration_ms"] for result in results),
+        "callbacks": results[0]["callbacks"],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Fresh interpreters per plugin"
+    )
+    args = parser.parse_args()
+
+    over_budget = []
+    print(f"{'plugin':<16}{'import':>10}{'registration':>14}{'callbacks':>11}")
+    for plugin, import_budget in IMPORT_BUDGETS_MS.items():
+        result = measure(plugin, args.runs)
+        print(
+            f"{plugin:<16}{result['import_ms']:>8.1f}ms"
+            f"{result['registration_ms']:>12.1f}ms{result['callbacks']:>11}"
+        )
+        if result["import_ms"] > import_budget:
+            over_budget.append(
+                f"{plugin} took {result['import_ms']:.1f}ms to import "
+                f"(budget: {import_budget}ms)"
+            )
+        if result["registration_ms"] > REGISTRATION_BUDGET_MS:
+            over_budget.append(
+                f"{plugin} took {result['registration_ms']:.1f}ms to register "
+                f"(budget: {REGISTRATION_BUDGET_MS}ms)"
+            )
+    for message in over_budget:
+        print(f"Over budget: {message}", file=sys.stderr)
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -40,6 +40,7 @@ setup(
     include_package_data=True,
     python_requires=">=3.7",
     install_requires=["tutor"],
+    extras_require={"zstd": ["zstandard"]},
     entry_points={
         "tutor.plugin.v1": [
             "automountvenvs = tutorkdmccormick.automountvenvs",
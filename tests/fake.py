@@ -0,0 +1,45 @@
+"""
+A stand-in for BenchRunner, for testing `tutor quickdev bench` without Docker:
+pass `--runner tests.fake:Runner`.
+"""
+from __future__ import annotations
+
+import time
+import typing as t
+
+
+class Runner:
+    """
+    Fakes each step of a start, recording the calls. Each step takes `delay` seconds.
+    """
+
+    delay = 0.0
+    calls: list[tuple[str, t.Any]] = []
+
+    def __init__(self, root: str, config: dict[str, t.Any], mounts: list[str]):
+        self.root = root
+        self.config = config
+        self.mounts = mounts
+
+    def _step(self, name: str, arg: t.Any = None) -> None:
+        self.calls.append((name, arg))
+        time.sleep(self.delay)
+
+    def reset_volumes(self, volume_names: list[str]) -> None:
+        self._step("reset_volumes", volume_names)
+
+    def stop(self, services: list[str]) -> None:
+        self._step("stop", services)
+
+    def create(self, services: list[str]) -> None:
+        self._step("create", services)
+
+    def pip_install_mounts(self) -> None:
+        self._step("pip_install_mounts")
+
+    def start(self, services: list[str]) -> None:
+        self._step("start", services)
+
+    def is_healthy(self, service: str) -> bool:
+        self.calls.append(("is_healthy", service))
+        return True
@@ -0,0 +1,124 @@
+"""
+Tests for `tutor quickdev bench`, with a stand-in runner (see fake.py).
+"""
+from __future__ import annotations
+
+import http.server
+import json
+import threading
+import types
+import typing as t
+
+import pytest
+from click.testing import CliRunner
+from tutor import config as tutor_config
+
+from tests import fake
+from tutorkdmccormick import bench, volumes
+
+# The quickdev plugin's config defaults are added when it's imported.
+from tutorkdmccormick import quickdev  # isort:skip pylint: disable=unused-import
+
+
+@pytest.fixture(name="root")
+def _root(tmp_path: t.Any, monkeypatch: pytest.MonkeyPatch) -> str:
+    # There's no Docker daemon to get the image's generation from.
+    monkeypatch.setenv("DOCKER_HOST", f"unix://{tmp_path}/no-docker.sock")
+    monkeypatch.setattr(fake.Runner, "calls", [])
+    root = str(tmp_path / "root")
+    tutor_config.save_config_file(root, {"QUICKDEV_SINGLE_ASSET_VOLUME": True})
+    return root
+
+
+def _bench(root: str, history_path: str, *args: str) -> t.Any:
+    return CliRunner().invoke(
+        bench.bench,
+        [
+            "--runner",
+            "tests.fake:Runner",
+            "--history",
+            history_path,
+            "--max-regression",
+            "20",
+            "--service",
+            "lms",
+            "--service",
+            "cms",
+            "--yes",
+            *args,
+        ],
+        obj=types.SimpleNamespace(root=root),
+    )
+
+
+def test_bench_records_history_and_fails_on_regression(
+    root: str, tmp_path: t.Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    history_path = str(tmp_path / "bench.jsonl")
+    monkeypatch.setattr(bench, "BENCH_NOISE_SECONDS", 0.1)
+
+    result = _bench(root, history_path)
+    assert result.exit_code == 0, result.output
+    assert (
+        "reset_volumes",
+        list(volumes.named_volumes({"QUICKDEV_SINGLE_ASSET_VOLUME": True})),
+    ) in fake.Runner.calls
+    assert ("create", ["lms", "cms"]) in fake.Runner.calls
+    assert ("stop", ["lms", "cms"]) in fake.Runner.calls
+    with open(history_path, encoding="utf-8") as history_file:
+        entries = [json.loads(line) for line in history_file]
+    assert [entry["scenario"] for entry in entries] == ["cold", "warm"]
+    for entry in entries:
+        assert entry["services"] == ["lms", "cms"]
+        assert entry["runner"] == "tests.fake:Runner"
+        assert entry["layout"] == {
+            "single_asset_volume": True,
+            "image_generations": True,
+        }
+        assert entry["timings"]["pip_install_mounts"] is None
+        assert set(entry["timings"]["healthy"]) == {"lms", "cms"}
+
+    # Just as fast: no regression.
+    result = _bench(root, history_path, "--scenario", "warm")
+    assert result.exit_code == 0, result.output
+    assert "previous" in result.output
+
+    monkeypatch.setattr(fake.Runner, "delay", 0.3)
+    result = _bench(root, history_path, "--scenario", "warm")
+    assert result.exit_code == 1
+    assert "Startup regressed since the previous comparable run" in result.output
+    assert "warm start:" in result.output
+    with open(history_path, encoding="utf-8") as history_file:
+        assert len(history_file.readlines()) == 4
+
+
+def test_is_healthy_sends_host_header(monkeypatch: pytest.MonkeyPatch) -> None:
+    hosts = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            hosts.append((self.path, self.headers["Host"]))
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args: t.Any) -> None:
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        port = server.server_address[1]
+        monkeypatch.setattr(bench, "BENCH_HTTP_PORTS", {"lms": port, "cms": port})
+        runner = bench.BenchRunner(
+            "/tmp", {"LMS_HOST": "lms.test", "CMS_HOST": "studio.lms.test"}, []
+        )
+        assert runner.is_healthy("lms")
+        assert runner.is_healthy("cms")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert hosts == [
+        ("/heartbeat", f"lms.test:{port}"),
+        ("/heartbeat", f"studio.lms.test:{port}"),
+    ]
@@ -0,0 +1,220 @@
+"""
+Tests for the Docker Engine API client, against a stand-in daemon which listens on
+a unix socket and keeps just enough state: volumes, and containers which mount them.
+"""
+from __future__ import annotations
+
+import http.server
+import io
+import json
+import socketserver
+import tarfile
+import threading
+import typing as t
+import urllib.parse
+
+import pytest
+
+from tutorkdmccormick.dockerapi import DockerApiError, DockerClient
+
+
+class _Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        super().__init__(socket_path, _Handler)
+        self.socket_path = socket_path
+        self.lock = threading.Lock()
+        self.volumes: set[str] = set()
+        self.containers: dict[str, dict[str, t.Any]] = {}
+        self.archives: dict[str, bytes] = {}
+        self.requests: list[str] = []
+
+    def add_container(
+        self, container_id: str, volumes: list[str], running: bool
+    ) -> None:
+        self.containers[container_id] = {
+            "Id": container_id,
+            "Volumes": volumes,
+            "Running": running,
+        }
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: _Daemon
+
+    def log_message(self, *args: t.Any) -> None:
+        pass
+
+    def _respond(self, status: int, data: t.Any = None) -> None:
+        body = b"" if data is None else json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # The client may already be gone if there's no body to wait for.
+        if body:
+            self.wfile.write(body)
+
+    def _error(self, status: int, message: str) -> None:
+        self._respond(status, {"message": message})
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding") != "chunked":
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        body = b""
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            chunk = self.rfile.read(size)
+            self.rfile.readline()
+            if not size:
+                return body
+            body += chunk
+
+    def _handle(self) -> None:
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        body = self._read_body()
+        with self.server.lock:
+            self.server.requests.append(f"{self.command} {self.path}")
+            if parts[0] == "containers":
+                self._handle_containers(parts[1:], query, body)
+            elif parts[0] == "volumes":
+                self._handle_volumes(parts[1:])
+            else:
+                self._error(404, "page not found")
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def _handle_containers(
+        self, parts: list[str], query: dict[str, list[str]], body: bytes
+    ) -> None:
+        containers = self.server.containers
+        if parts == ["json"]:
+            filters = json.loads(query.get("filters", ["{}"])[0])
+            self._respond(
+                200,
+                [
+                    container
+                    for container in containers.values()
+                    if (container["Running"] or query.get("all") == ["true"])
+                    and set(filters.get("volume", container["Volumes"]))
+                    & set(container["Volumes"])
+                ],
+            )
+            return
+        container = containers.get(parts[0])
+        if container is None:
+            self._error(404, f"No such container: {parts[0]}")
+        elif self.command == "POST" and parts[1:] == ["stop"]:
+            container["Running"] = False
+            self._respond(204)
+        elif self.command == "DELETE" and not parts[1:]:
+            if container["Running"]:
+                self._error(409, "You cannot remove a running container")
+            else:
+                del containers[parts[0]]
+                self._respond(204)
+        elif self.command == "PUT" and parts[1:] == ["archive"]:
+            self.server.archives[query["path"][0]] = body
+            self._respond(200)
+        else:
+            self._error(404, "page not found")
+
+    def _handle_volumes(self, parts: list[str]) -> None:
+        name = urllib.parse.unquote(parts[0])
+        if name not in self.server.volumes:
+            self._error(404, f"get {name}: no such volume")
+        elif self.command == "DELETE":
+            in_use = any(
+                name in container["Volumes"]
+                for container in self.server.containers.values()
+            )
+            if in_use:
+                self._error(409, f"remove {name}: volume is in use")
+            else:
+                self.server.volumes.remove(name)
+                self._respond(204)
+        else:
+            self._respond(200, {"Name": name})
+
+
+@pytest.fixture(name="daemon")
+def _daemon(tmp_path: t.Any) -> t.Iterator[_Daemon]:
+    daemon = _Daemon(str(tmp_path / "docker.sock"))
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    daemon.server_close()
+
+
+@pytest.fixture(name="client")
+def _client(daemon: _Daemon) -> DockerClient:
+    return DockerClient(daemon.socket_path, timeout=5)
+
+
+def test_remove_volumes_and_their_containers(
+    daemon: _Daemon, client: DockerClient
+) -> None:
+    daemon.volumes.update(["venv", "assets", "mysql"])
+    daemon.add_container("lms", ["venv", "assets"], running=True)
+    daemon.add_container("lms-run", ["venv"], running=False)
+    daemon.add_container("mysql", ["mysql"], running=True)
+
+    removed = client.remove_volumes_and_their_containers(["venv", "assets", "gone"])
+
+    assert removed == ["venv", "assets"]
+    assert daemon.volumes == {"mysql"}
+    assert list(daemon.containers) == ["mysql"]
+    assert daemon.containers["mysql"]["Running"]
+    # Anonymous volumes are removed along with the containers.
+    assert "DELETE /containers/lms?v=true" in daemon.requests
+    assert "DELETE /containers/lms-run?v=true" in daemon.requests
+
+
+def test_put_archive_from(daemon: _Daemon, client: DockerClient) -> None:
+    daemon.add_container("sync", [], running=False)
+    # Bigger than a single chunk of the upload.
+    content = bytes(range(256)) * 10000
+
+    def write_archive(tar: tarfile.TarFile) -> None:
+        info = tarfile.TarInfo("venv/lib/module.py")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+
+    client.put_archive_from("sync", "/", write_archive)
+
+    with tarfile.open(fileobj=io.BytesIO(daemon.archives["/"])) as tar:
+        assert tar.getnames() == ["venv/lib/module.py"]
+        extracted = tar.extractfile("venv/lib/module.py")
+        assert extracted is not None and extracted.read() == content
+
+
+def test_not_found(daemon: _Daemon, client: DockerClient) -> None:
+    # Some operations treat a 404 as "already done"...
+    assert not client.remove_volume("gone")
+    assert not client.volume_exists("gone")
+    client.stop_container("gone")
+    client.remove_container("gone")
+    # ...but others report it, with the daemon's message, even while streaming.
+    with pytest.raises(DockerApiError) as exc_info:
+        client.put_archive_from("gone", "/", lambda tar: None)
+    assert exc_info.value.status == 404
+    assert "No such container: gone" in str(exc_info.value)
+    assert daemon.archives == {}
+
+
+def test_conflict(daemon: _Daemon, client: DockerClient) -> None:
+    daemon.volumes.add("venv")
+    daemon.add_container("lms", ["venv"], running=True)
+
+    with pytest.raises(DockerApiError) as exc_info:
+        client.remove_volume("venv")
+    assert exc_info.value.status == 409
+    with pytest.raises(DockerApiError) as exc_info:
+        client.remove_container("lms")
+    assert exc_info.value.status == 409
+    assert daemon.volumes == {"venv"}
+    assert "lms" in daemon.containers
@@ -2,12 +2,42 @@
 A Tutor plugin to auto-mount folders prefixed with "venv-" as virtualenvs
 in various Tutor services.
 """
-from typing import List, Tuple
+import io
+import json
+import os
+from typing import TYPE_CHECKING, BinaryIO, Dict, List, Optional, Tuple
 
+import click
 from tutor import hooks
 
+from . import tracing
+from .dockerapi import DockerApiError, DockerClient
+
+if TYPE_CHECKING:
+    import tarfile
+
+# When this is enabled, "venv-<service>" folders aren't bind-mounted at /openedx/venv.
+# Instead, each one is synced into a named volume before the platform starts, and
+# the volume is mounted at /openedx/venv. The host folder remains the source of
+# truth, but containers get the import speed of a named volume.
+hooks.Filters.CONFIG_DEFAULTS.add_item(("AUTOMOUNTVENVS_SYNC", False))
+
+# File, within each synced volume, recording the mode, size, mtime and hash (or link
+# target) of each path as of the last sync. A path is only copied when its mode or
+# hash changes, and only re-hashed when its size or mtime changes.
+SYNC_MANIFEST = ".automountvenvs-manifest.json"
+
+# Where volumes are mounted within the throwaway containers used to sync them.
+# Since nothing exists at this path in the image, new volumes are created empty.
+SYNC_MOUNT_POINT = "/automountvenvs-volume"
+
+# The host folder of each volume which replaced a bind-mount, by mode ("dev" or
+# "local"), as of the last time that mode's docker-compose.tmp.yml was rendered.
+_SYNCED_VENVS: Dict[str, Dict[str, str]] = {"dev": {}, "local": {}}
+
 
 @hooks.Filters.COMPOSE_MOUNTS.add()
+@tracing.traced
 def _auto_mount_venvs(volumes: List[Tuple[str, str]], name: str):
     """
     If the given folder (`name`) is in the form "venv-<service>",
@@ -36,3 +66,309 @@ def _auto_mount_venvs(volumes: List[Tuple[str, str]], name: str):
                 (f"{service}-job", path),
             ]
     return volumes
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--service",
+    default="lms",
+    show_default=True,
+    help=(
+        "Service whose venv should be compiled. For venv-openedx, either lms or cms "
+        "will do, since they share the venv"
+    ),
+)
+def precompile_venv(service: str) -> List[Tuple[str, str]]:
+    """
+    Compile the bytecode of a mounted venv, in parallel across all CPUs.
+
+    Run it with the venv mounted, e.g.: tutor dev do -m venv-openedx precompile-venv
+
+    Otherwise, each container writes .pyc files through the bind-mount as it
+    first imports modules, and several containers race to compile the same modules.
+    The .pyc files are validated against a hash of their source, rather than its
+    modification time (which bind-mounts don't always preserve), so they stay valid
+    no matter which container imports them. Existing .pyc files (such as those
+    written by pip, which are timestamp-based) are recompiled.
+    """
+    script = """
+echo "Compiling bytecode in /openedx/venv..." >&2
+python -m compileall -q -f -j 0 --invalidation-mode checked-hash /openedx/venv || \\
+        echo "Some files could not be compiled. This is usually harmless." >&2
+"""
+    return [(service, script)]
+
+
+hooks.Filters.CLI_DO_COMMANDS.add_item(precompile_venv)
+
+
+@hooks.Actions.PROJECT_ROOT_READY.add()
+@tracing.traced
+def _add_venv_volumes_to_compose_files(root: str) -> None:
+    """
+    If AUTOMOUNTVENVS_SYNC is enabled, then replace each venv-<service> folder
+    that's bind-mounted at /openedx/venv with a named volume, whenever
+    docker-compose.tmp.yml is rendered.
+
+    Compose filters aren't given the config, so they're added once we know the
+    project root. They run after Tutor's own filters, which add the bind-mounts
+    from -m/--mount. Jobs (`tutor dev do`) have their own compose file, so they keep
+    using the bind-mounts.
+    """
+
+    @hooks.Filters.COMPOSE_DEV_TMP.add(priority=hooks.priorities.LOW)
+    def _replace_dev_venv_bind_mounts(docker_compose_tmp: dict) -> dict:
+        return _replace_venv_bind_mounts(docker_compose_tmp, root, "dev")
+
+    @hooks.Filters.COMPOSE_LOCAL_TMP.add(priority=hooks.priorities.LOW)
+    def _replace_local_venv_bind_mounts(docker_compose_tmp: dict) -> dict:
+        return _replace_venv_bind_mounts(docker_compose_tmp, root, "local")
+
+
+def _replace_venv_bind_mounts(compose_tmp: dict, root: str, mode: str) -> dict:
+    """
+    Replace each venv-<service> folder that's bind-mounted at /openedx/venv with
+    a named volume, and remember the host folder of each volume.
+    """
+    from tutor import config as tutor_config  # pylint: disable=import-outside-toplevel
+
+    synced: Dict[str, str] = {}
+    _SYNCED_VENVS[mode] = synced
+    if not tutor_config.get_user(root).get("AUTOMOUNTVENVS_SYNC"):
+        return compose_tmp
+    for service in (compose_tmp.get("services") or {}).values():
+        for index, volume in enumerate(service.get("volumes") or []):
+            host_path, _, container_path = str(volume).rpartition(":")
+            name = os.path.basename(host_path.rstrip("/"))
+            if container_path == "/openedx/venv" and name.startswith("venv-"):
+                volume_name = name.replace("-", "_")
+                synced[volume_name] = host_path
+                service["volumes"][index] = f"{volume_name}:/openedx/venv"
+    if synced:
+        compose_tmp["volumes"] = {
+            **(compose_tmp.get("volumes") or {}),
+            **{volume_name: {} for volume_name in synced},
+        }
+    return compose_tmp
+
+
+@hooks.Actions.COMPOSE_PROJECT_STARTED.add()
+@tracing.traced
+def _sync_venvs(root: str, config: dict, project_name: str) -> None:
+    """
+    If AUTOMOUNTVENVS_SYNC is enabled, then sync each venv-<service> folder into
+    the named volume which replaced its bind-mount, right before the project's
+    containers are started.
+
+    `tutor dev run` doesn't trigger this, so it uses the volume as of the last start.
+    """
+    # pylint: disable=unused-argument
+    if not config["AUTOMOUNTVENVS_SYNC"]:
+        return
+    is_dev = project_name == config["DEV_PROJECT_NAME"]
+    synced = _SYNCED_VENVS["dev" if is_dev else "local"]
+    image = config["DOCKER_IMAGE_OPENEDX_DEV" if is_dev else "DOCKER_IMAGE_OPENEDX"]
+    owner = _app_user_id(is_dev)
+    client = DockerClient()
+    for volume_name, host_path in synced.items():
+        click.echo(f"Syncing {host_path} into volume {volume_name}...")
+        try:
+            with tracing.span("sync venv", volume=volume_name) as span_args:
+                copied, deleted = _sync_venv(
+                    client, image, host_path, f"{project_name}_{volume_name}", owner
+                )
+                span_args.update(copied=copied, deleted=deleted)
+        except (OSError, DockerApiError) as exc:
+            raise click.ClickException(f"Failed to sync {host_path}: {exc}")
+        click.echo(f"  copied {copied} paths, deleted {deleted} paths")
+
+
+def _app_user_id(is_dev: bool) -> int:
+    """
+    Get the ID of the 'app' user which the openedx images run as, the same way that
+    Tutor picks it when building them.
+    """
+    from tutor import utils  # pylint: disable=import-outside-toplevel
+
+    return (utils.get_user_id() or 1000) if is_dev else 1000
+
+
+def _sync_venv(
+    client: DockerClient,
+    image: str,
+    host_path: str,
+    docker_volume_name: str,
+    owner: int,
+) -> Tuple[int, int]:
+    """
+    Make a volume's contents match a host folder, copying only what changed.
+
+    Everything in the volume, including its root, is owned by the `owner` user ID,
+    so that the containers can write to the venv, as they could to the bind-mount.
+
+    Returns the number of paths copied and deleted.
+    """
+    container_id = client.create_container(
+        image, [f"{docker_volume_name}:{SYNC_MOUNT_POINT}"]
+    )
+    try:
+        old_manifest = _read_volume_manifest(client, container_id)
+        with tracing.span("scan venv", path=host_path):
+            new_manifest = _scan_venv(host_path, old_manifest)
+        to_copy, to_delete = _diff_manifests(old_manifest, new_manifest)
+        _delete_from_volume(client, image, docker_volume_name, to_delete)
+        client.put_archive_from(
+            container_id,
+            SYNC_MOUNT_POINT,
+            lambda tar: _write_sync_archive(
+                tar, host_path, to_copy, new_manifest, owner
+            ),
+        )
+    finally:
+        client.remove_container(container_id)
+    return len(to_copy), len(to_delete)
+
+
+def _diff_manifests(
+    old_manifest: Dict[str, list], new_manifest: Dict[str, list]
+) -> Tuple[List[str], List[str]]:
+    """
+    Get the paths which must be copied into the volume, and those which must be
+    deleted from it first (because they're gone, or have changed type).
+    """
+    to_copy = [
+        path
+        for path, entry in new_manifest.items()
+        if _sync_key(entry) != _sync_key(old_manifest.get(path))
+    ]
+    to_delete = [
+        path
+        for path, entry in old_manifest.items()
+        if path not in new_manifest or new_manifest[path][0] != entry[0]
+    ]
+    return to_copy, to_delete
+
+
+def _sync_key(entry: Optional[list]) -> Optional[tuple]:
+    """
+    The parts of a manifest entry which determine whether a path must be copied.
+    """
+    return None if entry is None else (entry[0], entry[1], entry[4])
+
+
+def _delete_from_volume(
+    client: DockerClient, image: str, docker_volume_name: str, paths: List[str]
+) -> None:
+    """
+    Delete paths (relative to its root) from a volume.
+
+    This requires actually running a container. Paths are passed in batches, to
+    stay well within the limit on command-line length.
+    """
+    for start in range(0, len(paths), 1000):
+        exit_code = client.run_container(
+            image,
+            ["rm", "-rf", "--", *paths[start : start + 1000]],
+            [f"{docker_volume_name}:{SYNC_MOUNT_POINT}"],
+            SYNC_MOUNT_POINT,
+        )
+        if exit_code:
+            raise click.ClickException(
+                f"Failed to delete files from volume {docker_volume_name}"
+            )
+
+
+def _write_sync_archive(
+    tar: "tarfile.TarFile",
+    host_path: str,
+    paths: List[str],
+    manifest: Dict[str, list],
+    owner: int,
+) -> None:
+    """
+    Write the given paths within a host folder, and the folder's manifest, into an
+    archive which is extracted at the root of the volume.
+    """
+    import tarfile  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    def add(info: tarfile.TarInfo, file: Optional[BinaryIO] = None) -> None:
+        info.uid = info.gid = owner
+        info.uname = info.gname = ""
+        tar.addfile(info, file)
+
+    # Otherwise, the root of a new volume would be owned by root.
+    add(tar.gettarinfo(host_path, arcname="."))
+    for path in paths:
+        full_path = os.path.join(host_path, path)
+        info = tar.gettarinfo(full_path, arcname=path)
+        if info.islnk():
+            # Always add whole files, rather than hard links to files
+            # elsewhere in the archive, since those might not be copied.
+            info.type = tarfile.REGTYPE
+            info.linkname = ""
+            info.size = os.path.getsize(full_path)
+        if info.isreg():
+            with open(full_path, "rb") as file:
+                add(info, file)
+        else:
+            add(info)
+    manifest_data = json.dumps(manifest).encode("utf-8")
+    info = tarfile.TarInfo(SYNC_MANIFEST)
+    info.size = len(manifest_data)
+    add(info, io.BytesIO(manifest_data))
+
+
+def _read_volume_manifest(client: DockerClient, container_id: str) -> Dict[str, list]:
+    import tarfile  # pylint: disable=import-outside-toplevel
+
+    try:
+        with client.get_archive(
+            container_id, f"{SYNC_MOUNT_POINT}/{SYNC_MANIFEST}"
+        ) as archive:
+            with tarfile.open(fileobj=archive, mode="r|") as tar:
+                for member in tar:
+                    manifest_file = tar.extractfile(member)
+                    if manifest_file:
+                        return json.load(manifest_file)
+    except DockerApiError as exc:
+        if exc.status != 404:
+            raise
+    return {}
+
+
+def _scan_venv(host_path: str, old_manifest: Dict[str, list]) -> Dict[str, list]:
+    """
+    Build the manifest of a host folder, as a map from each relative path to its
+    [type, mode, size, mtime_ns, hash or link target].
+
+    Files whose size and mtime match the old manifest aren't re-hashed.
+    """
+    import hashlib  # pylint: disable=import-outside-toplevel
+
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(host_path):
+        dirnames.sort()
+        for name in dirnames + sorted(filenames):
+            full_path = os.path.join(dirpath, name)
+            path = os.path.relpath(full_path, host_path)
+            stat = os.lstat(full_path)
+            if os.path.islink(full_path):
+                entry = ["l", stat.st_mode, 0, 0, os.readlink(full_path)]
+            elif os.path.isdir(full_path):
+                entry = ["d", stat.st_mode, 0, 0, ""]
+            else:
+                old = old_manifest.get(path)
+                if old and old[:4] == [
+                    "f",
+                    stat.st_mode,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ]:
+                    digest = old[4]
+                else:
+                    with open(full_path, "rb") as file:
+                        digest = hashlib.sha256(file.read()).hexdigest()
+                entry = ["f", stat.st_mode, stat.st_size, stat.st_mtime_ns, digest]
+            manifest[path] = entry
+    return manifest
@@ -0,0 +1,410 @@
+"""
+The `tutor quickdev bench` command, which measures how quickly the lms* & cms*
+services start, which is what the named volumes in volumes.py are meant to speed up.
+
+This isn't a plugin itself; the quickdev plugin adds this command. Each run is either:
+* cold: the current generation of named volumes is deleted first, so that it is
+  re-populated from the image, as after building or pulling a new image; or
+* warm: the services are stopped, and then started again with their volumes intact.
+Each run times: creating the containers (which is when Docker populates empty named
+volumes from the image), `pip-install-mounts` (if any packages are mounted),
+`tutor dev start`, and how long after the start each service becomes healthy (that
+is, answers with HTTP 200, or for workers, is running). Results are appended to a
+JSON Lines history file along with the volume layout, and compared against the
+previous comparable run.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+import typing as t
+
+import click
+
+from . import tracing, volumes
+from .dockerapi import DockerApiError, DockerClient
+
+BENCH_SERVICES = ["lms", "cms", "lms-worker", "cms-worker"]
+
+# Host ports of the dev web servers, and the path at which we probe them.
+BENCH_HTTP_PORTS = {"lms": 8000, "cms": 8001}
+BENCH_HTTP_PATH = "/heartbeat"
+
+# Timing differences smaller than this, in seconds, are never regressions.
+BENCH_NOISE_SECONDS = 1.0
+
+
+class BenchRunner:
+    """
+    Performs the steps of `tutor quickdev bench` on the `tutor dev` project.
+
+    To benchmark something else (such as a stand-in for Docker Compose which fakes
+    each step, in order to test the benchmark itself), pass `--runner module:Class`,
+    where the class has the same constructor and methods as this one.
+    """
+
+    def __init__(self, root: str, config: dict[str, t.Any], mounts: list[str]):
+        self.root = root
+        self.config = config
+        self.mount_args = [arg for mount in mounts for arg in ("--mount", mount)]
+
+    def reset_volumes(self, volume_names: list[str]) -> None:
+        """
+        Delete the given named volumes, so that the next start re-populates them.
+        """
+        volumes.delete_volumes(self.config, volume_names)
+
+    def stop(self, services: list[str]) -> None:
+        """
+        Stop the given services, keeping their containers and volumes.
+        """
+        tracing.check_call(["tutor", "dev", "stop", *services])
+
+    def create(self, services: list[str]) -> None:
+        """
+        Create the containers of the given services without starting them, which
+        populates any empty named volumes from the image.
+        """
+        tracing.check_call(
+            ["tutor", "dev", "dc", *self.mount_args, "up", "--no-start", *services]
+        )
+
+    def pip_install_mounts(self) -> None:
+        """
+        Install the mounted packages into the venv.
+        """
+        tracing.check_call(
+            ["tutor", "dev", "do", *self.mount_args, "pip-install-mounts"]
+        )
+
+    def start(self, services: list[str]) -> None:
+        """
+        Start the given services in the background.
+        """
+        tracing.check_call(
+            ["tutor", "dev", "start", "--detach", *self.mount_args, *services]
+        )
+
+    def is_healthy(self, service: str) -> bool:
+        """
+        Check whether a service is up: web servers must answer their heartbeat
+        with HTTP 200, and workers must be running.
+
+        Web servers are reached through their published ports, on the loopback
+        interface, since LMS_HOST and CMS_HOST needn't resolve to this machine.
+        They're still sent as the Host header, which the platform checks.
+        """
+        # pylint: disable=import-outside-toplevel
+        import urllib.error
+        import urllib.request
+
+        if service in BENCH_HTTP_PORTS:
+            host = self.config["CMS_HOST" if service == "cms" else "LMS_HOST"]
+            port = BENCH_HTTP_PORTS[service]
+            request = urllib.request.Request(
+                f"http://127.0.0.1:{port}{BENCH_HTTP_PATH}",
+                headers={"Host": f"{host}:{port}"},
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=2) as response:
+                    return response.status == 200
+            except (OSError, urllib.error.URLError):
+                return False
+        try:
+            containers = DockerClient().running_compose_containers()
+        except (OSError, DockerApiError):
+            return False
+        return any(
+            container["Labels"].get("com.docker.compose.project")
+            == self.config["DEV_PROJECT_NAME"]
+            and container["Labels"].get("com.docker.compose.service") == service
+            for container in containers
+        )
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--service",
+    "services",
+    multiple=True,
+    default=BENCH_SERVICES,
+    show_default=True,
+    help="Service to start and time (may be repeated)",
+)
+@click.option(
+    "-m",
+    "--mount",
+    "mounts",
+    multiple=True,
+    help=(
+        "Mount a package or repository, as with `tutor dev start --mount` (may be "
+        "repeated). Mounted packages are installed before each start"
+    ),
+)
+@click.option(
+    "--scenario",
+    "scenarios",
+    multiple=True,
+    type=click.Choice(["cold", "warm"]),
+    default=["cold", "warm"],
+    show_default=True,
+    help="Kind of start to run (may be repeated)",
+)
+@click.option(
+    "-n", "--runs", type=int, default=1, show_default=True, help="Runs per scenario"
+)
+@click.option(
+    "-t",
+    "--timeout",
+    type=float,
+    default=600,
+    show_default=True,
+    help="Seconds to wait for the services to become healthy",
+)
+@click.option(
+    "--history",
+    "history_path",
+    type=click.Path(dir_okay=False),
+    help=(
+        "JSON Lines file to append results to, instead of "
+        "data/quickdev/bench.jsonl in the project root"
+    ),
+)
+@click.option(
+    "--max-regression",
+    type=float,
+    help=(
+        "Fail if any timing is this many percent slower than in the previous "
+        "comparable run"
+    ),
+)
+@click.option(
+    "--runner",
+    "runner_path",
+    help="Use another implementation of BenchRunner, given as 'module:Class'",
+)
+@click.option(
+    "-y",
+    "--yes",
+    is_flag=True,
+    help="Don't ask for confirmation before deleting volumes for cold starts",
+)
+@click.pass_obj
+def bench(context: t.Any, **kwargs: t.Any) -> None:
+    """
+    Time cold and warm starts of the platform, and record the results.
+
+    Cold starts delete the current generation of Python, NPM, and static asset
+    volumes, so any changes to them are lost.
+    """
+    options = _BenchOptions(**kwargs)
+    config = volumes.load_config(context.root)
+    if "cold" in options.scenarios and not options.yes:
+        click.confirm(
+            "Cold starts delete your Python, NPM, and static asset volumes. "
+            "Continue?",
+            abort=True,
+        )
+    runner = _load_bench_runner(options.runner_path)(
+        context.root, config, list(options.mounts)
+    )
+    history_path = options.history_path or _bench_history_path(context.root)
+    history = _load_bench_history(history_path)
+    regressions = []
+    for scenario in options.scenarios:
+        for run in range(1, options.runs + 1):
+            entry = {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "scenario": scenario,
+                "services": list(options.services),
+                "mounts": list(options.mounts),
+                "layout": {
+                    "single_asset_volume": config["QUICKDEV_SINGLE_ASSET_VOLUME"],
+                    "image_generations": config["QUICKDEV_IMAGE_GENERATIONS"],
+                },
+                "runner": options.runner_path or "",
+                "image": volumes.image_generation(config["DOCKER_IMAGE_OPENEDX_DEV"]),
+                "timings": _bench_run(runner, config, scenario, options),
+            }
+            previous = next(
+                (
+                    old_entry
+                    for old_entry in reversed(history)
+                    if _bench_key(old_entry) == _bench_key(entry)
+                ),
+                None,
+            )
+            click.echo(f"{scenario} start #{run}: {_format_bench_timings(entry)}")
+            if previous:
+                click.echo(
+                    f"  previous ({previous['time']}): "
+                    f"{_format_bench_timings(previous)}"
+                )
+                regressions += _bench_regressions(
+                    previous, entry, options.max_regression
+                )
+            history.append(entry)
+            _append_bench_history(history_path, entry)
+    click.echo(f"Results were appended to {history_path}.")
+    if regressions:
+        raise click.ClickException(
+            "Startup regressed since the previous comparable run:\n"
+            + "\n".join(regressions)
+        )
+
+
+class _BenchOptions(t.NamedTuple):
+    """
+    The command-line options of `tutor quickdev bench`.
+    """
+
+    services: tuple[str, ...]
+    mounts: tuple[str, ...]
+    scenarios: tuple[str, ...]
+    runs: int
+    timeout: float
+    history_path: t.Optional[str]
+    max_regression: t.Optional[float]
+    runner_path: t.Optional[str]
+    yes: bool
+
+
+def _load_bench_runner(runner_path: t.Optional[str]) -> type[BenchRunner]:
+    """
+    Import the BenchRunner implementation given as 'module:Class', if any.
+    """
+    # pylint: disable=import-outside-toplevel
+    import importlib
+
+    if not runner_path:
+        return BenchRunner
+    module_name, _, class_name = runner_path.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _bench_run(
+    runner: BenchRunner,
+    config: dict[str, t.Any],
+    scenario: str,
+    options: _BenchOptions,
+) -> dict[str, t.Any]:
+    """
+    Run one cold or warm start, and return its timings, in seconds.
+
+    A service which doesn't become healthy before the timeout gets a timing of None.
+    """
+    services = list(options.services)
+    if scenario == "cold":
+        runner.reset_volumes(list(volumes.named_volumes(config)))
+    else:
+        runner.stop(services)
+    timings: dict[str, t.Any] = {"pip_install_mounts": None}
+    with tracing.span("bench create", scenario=scenario):
+        start = time.perf_counter()
+        runner.create(services)
+        timings["populate_volumes"] = time.perf_counter() - start
+    if options.mounts:
+        with tracing.span("bench pip-install-mounts", scenario=scenario):
+            start = time.perf_counter()
+            runner.pip_install_mounts()
+            timings["pip_install_mounts"] = time.perf_counter() - start
+    with tracing.span("bench start", scenario=scenario):
+        start = time.perf_counter()
+        runner.start(services)
+        timings["start"] = time.perf_counter() - start
+        healthy: dict[str, t.Optional[float]] = dict.fromkeys(services)
+        while time.perf_counter() - start < options.timeout:
+            for service in services:
+                if healthy[service] is None and runner.is_healthy(service):
+                    healthy[service] = time.perf_counter() - start
+            if all(seconds is not None for seconds in healthy.values()):
+                break
+            time.sleep(0.5)
+    timings["healthy"] = healthy
+    return timings
+
+
+def _bench_key(entry: dict[str, t.Any]) -> list[t.Any]:
+    """
+    Runs are comparable if they started the same way, in the same volume layout.
+    """
+    return [
+        entry["scenario"],
+        entry["services"],
+        entry["mounts"],
+        entry["layout"],
+        entry["runner"],
+    ]
+
+
+def _flat_bench_timings(entry: dict[str, t.Any]) -> dict[str, t.Optional[float]]:
+    timings = entry["timings"]
+    return {
+        "populate volumes": timings["populate_volumes"],
+        "pip-install-mounts": timings["pip_install_mounts"],
+        "start": timings["start"],
+        **{
+            f"{service} healthy": seconds
+            for service, seconds in timings["healthy"].items()
+        },
+    }
+
+
+def _format_bench_timings(entry: dict[str, t.Any]) -> str:
+    return ", ".join(
+        f"{label} {'timed out' if seconds is None else f'{seconds:.1f}s'}"
+        for label, seconds in _flat_bench_timings(entry).items()
+        if seconds is not None or label.endswith(" healthy")
+    )
+
+
+def _bench_regressions(
+    previous: dict[str, t.Any],
+    current: dict[str, t.Any],
+    max_regression: t.Optional[float],
+) -> list[str]:
+    """
+    Describe each timing which is more than `max_regression` percent slower than
+    the previous run's (ignoring differences within BENCH_NOISE_SECONDS).
+    """
+    if max_regression is None:
+        return []
+    previous_timings = _flat_bench_timings(previous)
+    regressions = []
+    for label, seconds in _flat_bench_timings(current).items():
+        before = previous_timings.get(label)
+        if before is None:
+            continue
+        if seconds is None:
+            regressions.append(f"{current['scenario']} {label}: timed out")
+        elif (
+            seconds > before * (1 + max_regression / 100)
+            and seconds - before > BENCH_NOISE_SECONDS
+        ):
+            regressions.append(
+                f"{current['scenario']} {label}: {before:.1f}s -> {seconds:.1f}s"
+            )
+    return regressions
+
+
+def _bench_history_path(root: str) -> str:
+    # pylint: disable=import-outside-toplevel
+    from tutor import env as tutor_env
+
+    return tutor_env.data_path(root, "quickdev", "bench.jsonl")
+
+
+def _load_bench_history(path: str) -> list[dict[str, t.Any]]:
+    try:
+        with open(path, encoding="utf-8") as history_file:
+            return [json.loads(line) for line in history_file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _append_bench_history(path: str, entry: dict[str, t.Any]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as history_file:
+        history_file.write(json.dumps(entry) + "\n")
@@ -1,79 +1,758 @@
 """
 Implementation of the configdiff mini-plugin. See README for documentation.
 """
+from __future__ import annotations
+
+import json
+import errno
+import functools
 import os
-from subprocess import run, CalledProcessError, PIPE, STDOUT
+import shutil
+import tempfile
+import typing as t
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
 import click
 from tutor import hooks
 
+from . import tracing
+
+if t.TYPE_CHECKING:
+    import jinja2
+    from tutor import env as tutor_env
+
+# Directory, relative to the project root, in which rendered templates are cached
+# between `tutor configdiff --in-process` runs.
+RENDER_CACHE_DIRNAME = ".configdiff-cache"
+
+# File, under the project's data directory, holding the fingerprint of the inputs
+# of the env as of the last time it was saved (by `tutor config save`, `tutor
+# dev/local launch`, etc.), or as of the last `tutor dev/local` command which found
+# the env to be up to date.
+FINGERPRINT_PATH = ("configdiff", "fingerprint")
+
+# Whether `tutor dev/local` commands warn when the env is out of date.
+hooks.Filters.CONFIG_DEFAULTS.add_item(("CONFIGDIFF_CHECK_ON_START", True))
+
 
 @hooks.Actions.PROJECT_ROOT_READY.add()
+@tracing.traced
 def _record_tutor_root(root: str):
     @click.command()
-    def configdiff():
-        compare_root = Path("/", "tmp", "tutor-contrib-kdmccormick", "configdiff")
-        actual_root = Path(root)
-        before = Path("BEFORE")
-        after = Path("AFTER")
-        run(["rm", "-rf", compare_root], check=True)
-        run(["mkdir", "-p", compare_root / after], check=True)
-        run(["mkdir", "-p", compare_root / before], check=True)
-        run(
-            [
-                "cp",
-                "-r",
-                actual_root / "config.yml",
-                actual_root / "env",
-                compare_root / before,
-            ],
-            check=True,
+    @click.option(
+        "-i",
+        "--in-process",
+        is_flag=True,
+        default=False,
+        show_default=True,
+        help=(
+            "Render the updated environment in memory using the already-loaded "
+            "config and plugins, instead of running `tutor config save` on a "
+            "copy of the project root"
+        ),
+    )
+    @click.option(
+        "--no-cache",
+        is_flag=True,
+        default=False,
+        show_default=True,
+        help=(
+            f"With --in-process, re-render every template instead of using the "
+            f"render cache stored in {RENDER_CACHE_DIRNAME}/ under the project root"
+        ),
+    )
+    @click.option(
+        "-f",
+        "--format",
+        "output_format",
+        type=click.Choice(["text", "json"]),
+        default="text",
+        show_default=True,
+        help=(
+            "Print unified diffs, or print a JSON summary of added, removed, "
+            "and changed files"
+        ),
+    )
+    def configdiff(in_process: bool, no_cache: bool, output_format: str):
+        if in_process:
+            cache = None if no_cache else _RenderCache(Path(root, RENDER_CACHE_DIRNAME))
+            file_diffs = _diff_env_in_process(root, cache)
+            if cache:
+                click.echo(
+                    f"Render cache: {cache.hits} hits, {cache.misses} misses.", err=True
+                )
+            _echo_file_diffs(file_diffs, output_format)
+            return
+
+        # Snapshot into a fresh directory within the project root, so that
+        # concurrent runs don't clobber each other, and so that hardlinks
+        # (which cannot cross filesystems) are possible.
+        # pylint: disable=import-outside-toplevel
+        import subprocess
+
+        with tempfile.TemporaryDirectory(prefix=".configdiff-", dir=root) as tmp:
+            actual_root = Path(root)
+            after = Path(tmp)
+            # config.yml is small, and `tutor config save` may rewrite it, so
+            # a real copy is needed.
+            shutil.copy2(actual_root / "config.yml", after / "config.yml")
+            try:
+                tracing.run(
+                    ["tutor", "config", "save"],
+                    env={**os.environ, "TUTOR_ROOT": str(after)},
+                    check=True,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                )
+            except subprocess.CalledProcessError as exc:
+                click.echo(
+                    "------------------------------------------------------------",
+                    err=True,
+                )
+                click.echo(exc.output.decode("utf-8"), err=True)
+                click.echo(
+                    "------------------------------------------------------------",
+                    err=True,
+                )
+                raise click.ClickException(
+                    "Failed to run `tutor config save. Output is captured above."
+                )  # pylint: disable=raise-missing-from
+            # `tutor config save` never deletes files, so any file that it did not
+            # write is carried over unchanged from the current env.
+            with tracing.span("clone missing files"):
+                _clone_missing_files(actual_root / "env", after / "env")
+            with tracing.span("diff env"):
+                file_diffs = _diff_trees(actual_root / "env", after / "env")
+            _echo_file_diffs(file_diffs, output_format)
+
+    hooks.Filters.CLI_COMMANDS.add_item(configdiff)
+
+
+@hooks.Actions.PROJECT_ROOT_READY.add()
+@tracing.traced
+def _wrap_env_save(_root: str) -> None:
+    """
+    Make every save of the env record the fingerprint of its inputs once it has
+    succeeded, whether it comes from `tutor config save`, `tutor dev/local launch`,
+    or an upgrade.
+
+    HACK: Tutor has no hook for when the env is saved, so we wrap `tutor.env.save`,
+    which all of those commands look up at call time.
+    """
+    # pylint: disable=import-outside-toplevel
+    from tutor import env as tutor_env
+
+    save = tutor_env.save
+    if hasattr(save, "configdiff_wrapped"):
+        return
+
+    @functools.wraps(save)
+    def save_and_record_fingerprint(root: str, config: t.Any) -> None:
+        save(root, config)
+        with tracing.span("record fingerprint"):
+            _save_fingerprint(root, _fingerprint(config))
+
+    save_and_record_fingerprint.configdiff_wrapped = True  # type: ignore
+    tutor_env.save = save_and_record_fingerprint
+
+
+@hooks.Actions.COMPOSE_PROJECT_STARTED.add()
+@tracing.traced
+def _check_env_on_start(root: str, config: dict, project_name: str) -> None:
+    """
+    Warn when starting a project whose env is out of date, i.e., when
+    `tutor config save` would change it.
+
+    Usually, this takes a few milliseconds, since the fingerprint of the env's inputs
+    is unchanged since they were last saved. Otherwise, we fall back to rendering the
+    env in-process (with the render cache) and diffing it. If it turns out to be up
+    to date after all, then the new fingerprint is recorded, so that the next start
+    is fast again.
+    """
+    if not config["CONFIGDIFF_CHECK_ON_START"]:
+        return
+    with tracing.span("fingerprint") as span_args:
+        fingerprint = _fingerprint(config)
+        span_args["changed"] = fingerprint != _load_fingerprint(root)
+    if not span_args["changed"]:
+        return
+    file_diffs = _diff_env_in_process(
+        root, _RenderCache(Path(root, RENDER_CACHE_DIRNAME))
+    )
+    if file_diffs:
+        click.echo(
+            f"Warning: your Tutor environment is out of date for {project_name}: "
+            f"`tutor config save` would change {len(file_diffs)} file(s). Run "
+            "`tutor configdiff` to see how, and `tutor config save` to update it.",
+            err=True,
+        )
+    else:
+        _save_fingerprint(root, fingerprint)
+
+
+def _fingerprint(config: t.Mapping[str, t.Any]) -> str:
+    """
+    Hash the inputs of the env, quickly.
+
+    The inputs are: the full config (which includes config.yml and the defaults of
+    all plugins), the names and versions of the loaded plugins, the Tutor version,
+    the contents of all patches, and the path, size & mtime of every file in the
+    template roots. This doesn't cover template variables and filters, which are
+    code; changes to them are covered by the plugin versions, at best.
+    """
+    # pylint: disable=import-outside-toplevel
+    # HACK: Not part of the official plugin API.
+    from tutor import env as tutor_env
+    from tutor.__about__ import __version__
+
+    loaded_plugins = set(hooks.Filters.PLUGINS_LOADED.iterate())
+    templates = [
+        [template_root, path, stat.st_size, stat.st_mtime_ns]
+        for template_root in hooks.Filters.ENV_TEMPLATE_ROOTS.apply(
+            [tutor_env.TEMPLATES_ROOT]
         )
-        run(
-            [
-                "cp",
-                "-r",
-                actual_root / "config.yml",
-                actual_root / "env",
-                compare_root / after,
-            ],
-            check=True,
+        for path, stat in sorted(_list_files(Path(template_root)).items())
+    ]
+    inputs = {
+        "tutor": __version__,
+        "plugins": sorted(
+            [name, info]
+            for name, info in hooks.Filters.PLUGINS_INFO.iterate()
+            if name in loaded_plugins
+        ),
+        "config": config,
+        "patches": sorted(hooks.Filters.ENV_PATCHES.iterate()),
+        "templates": templates,
+    }
+    return _hash(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8"))
+
+
+def _load_fingerprint(root: str) -> t.Optional[str]:
+    try:
+        return Path(root, "data", *FINGERPRINT_PATH).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+
+
+def _save_fingerprint(root: str, fingerprint: str) -> None:
+    path = Path(root, "data", *FINGERPRINT_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(fingerprint, encoding="utf-8")
+
+
+def _diff_env_in_process(
+    root: str, cache: t.Optional[_RenderCache] = None
+) -> list[_FileDiff]:
+    """
+    Render the env in memory, and diff it against the on-disk env.
+
+    If a cache is provided, then it is used for rendering, and it is updated with
+    the files which were found to be up to date.
+    """
+    env_root = Path(root, "env")
+    with tracing.span("render env", cached=bool(cache)):
+        rendered = _render_env_in_process(root, cache)
+    with tracing.span("diff env", files=len(rendered)):
+        file_diffs = _diff_rendered_against_env(rendered, env_root)
+    if cache:
+        changed = {file_diff.path for file_diff in file_diffs}
+        for path in rendered.keys() - changed:
+            cache.mark_clean(path, env_root / path)
+        cache.save()
+    return file_diffs
+
+
+def _render_env_in_process(
+    root: str, cache: t.Optional[_RenderCache] = None
+) -> dict[str, t.Union[str, bytes]]:
+    """
+    Render the whole Tutor environment in memory, the same way that
+    `tutor config save --env-only` would write it to disk.
+
+    Returns a mapping of paths (relative to the env directory) to rendered contents.
+
+    If a cache is provided, then templates whose inputs have not changed are not
+    re-rendered. Furthermore, templates whose inputs have not changed *and* whose
+    on-disk counterparts were already found to be up-to-date are omitted entirely
+    from the result, so that they need not be diffed again.
+    """
+    # pylint: disable=import-outside-toplevel
+    # HACK: None of these modules are part of the official plugin API.
+    from tutor import config as tutor_config
+    from tutor import env as tutor_env
+
+    config = tutor_config.load_full(root)
+    rendered: dict[str, t.Union[str, bytes]] = {}
+    for src, dst in hooks.Filters.ENV_TEMPLATE_TARGETS.iterate():
+        renderer = tutor_env.Renderer(config)
+        for template_name in renderer.iter_templates_in(src.replace(os.sep, "/")):
+            path = os.path.join(dst, template_name.replace("/", os.sep))
+            if not cache:
+                rendered[path] = renderer.render_template(template_name)
+                continue
+            key = cache.key(renderer, template_name)
+            if cache.is_clean(path, key, Path(root, "env", path)):
+                cache.hits += 1
+                continue
+            cached = cache.get(path, key)
+            if cached is not None:
+                cache.hits += 1
+                rendered[path] = (
+                    cached
+                    if tutor_env.is_binary_file(template_name)
+                    else cached.decode("utf-8")
+                )
+                continue
+            cache.misses += 1
+            rendered[path] = renderer.render_template(template_name)
+            cache.put(path, key, rendered[path])
+    return rendered
+
+
+class _RenderCache:
+    """
+    A persistent, on-disk cache of rendered environment templates.
+
+    Each rendered template is stored under a key which is a hash of:
+    * the source of the template, plus any templates it includes/imports/extends;
+    * the values of every config setting & template variable that those sources use;
+    * the contents of every ENV_PATCHES entry that those sources use
+      (recursively, since patches may use variables and other patches, too).
+
+    Templates that reference something we can't statically resolve (for example,
+    `{% include some_variable %}`) get a key of None and are never cached.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._index_path = directory / "index.json"
+        try:
+            index = json.loads(self._index_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            index = {}
+        # Maps env paths to {"key": ..., "clean": [size, mtime_ns] or None}.
+        self._entries: dict[str, dict[str, t.Any]] = index.get("entries", {})
+        # Maps source hashes to the (JSON-friendly) dependencies of that source,
+        # so that unchanged templates don't even need to be re-parsed.
+        self._dependencies: dict[str, dict[str, t.Any]] = index.get("dependencies", {})
+
+    def save(self) -> None:
+        """
+        Write the index, and delete the rendered objects which it no longer references.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index_path.write_text(
+            json.dumps({"entries": self._entries, "dependencies": self._dependencies}),
+            encoding="utf-8",
         )
+        referenced = {entry["key"] for entry in self._entries.values()}
+        try:
+            object_paths = list((self.directory / "objects").iterdir())
+        except FileNotFoundError:
+            return
+        for object_path in object_paths:
+            if object_path.name not in referenced:
+                try:
+                    object_path.unlink()
+                except FileNotFoundError:
+                    # A concurrent run has deleted it already.
+                    pass
 
+    def get(self, path: str, key: t.Optional[str]) -> t.Optional[bytes]:
+        """
+        Get the cached render of an env path, if it was rendered with this key.
+        """
+        if key is None or self._entries.get(path, {}).get("key") != key:
+            return None
         try:
-            run(
-                ["tutor", "config", "save"],
-                env={**os.environ, "TUTOR_ROOT": compare_root / after},
-                check=True,
-                stdout=PIPE,
-                stderr=STDOUT,
+            return (self.directory / "objects" / key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put(self, path: str, key: t.Optional[str], content: t.Union[str, bytes]):
+        """
+        Cache the render of an env path under its key (or forget it, if the key is None).
+        """
+        if key is None:
+            self._entries.pop(path, None)
+            return
+        objects = self.directory / "objects"
+        objects.mkdir(parents=True, exist_ok=True)
+        (objects / key).write_bytes(
+            content if isinstance(content, bytes) else content.encode("utf-8")
+        )
+        self._entries[path] = {"key": key, "clean": None}
+
+    def is_clean(self, path: str, key: t.Optional[str], env_file: Path) -> bool:
+        """
+        Was the on-disk file found to match this exact render, and is it unmodified since?
+        """
+        entry = self._entries.get(path, {})
+        if key is None or entry.get("key") != key or not entry.get("clean"):
+            return False
+        return entry["clean"] == _stat_signature(env_file)
+
+    def mark_clean(self, path: str, env_file: Path) -> None:
+        """
+        Record that the on-disk file matches the cached render, as of its current stat.
+        """
+        if path in self._entries:
+            self._entries[path]["clean"] = _stat_signature(env_file)
+
+    def key(self, renderer: tutor_env.Renderer, template_name: str) -> t.Optional[str]:
+        """
+        Hash everything that the render of a template depends on (see above).
+        """
+        # pylint: disable=import-outside-toplevel,redefined-outer-name
+        from tutor import env as tutor_env
+
+        environment = renderer.environment
+        if tutor_env.is_binary_file(template_name):
+            # Binary files are copied as-is, so their key is just their contents.
+            return _hash(environment.read_bytes(template_name))
+
+        dependencies = self._get_all_dependencies(environment, template_name)
+        if dependencies is None:
+            return None
+        sources, variables, patch_names, flags = dependencies
+        values = {**environment.globals, **renderer.config}
+        inputs = {
+            "sources": sources,
+            "variables": {
+                name: values.get(name)
+                for name in sorted(variables)
+                if not callable(values.get(name))
+            },
+            "patches": {
+                name: list(hooks.Filters.ENV_PATCH(name).iterate())
+                for name in sorted(patch_names)
+            },
+            # iter_values_named() can read any config value.
+            "config": renderer.config if "all_config" in flags else None,
+            # walk_templates() depends on the list of templates.
+            "templates": (
+                sorted(environment.loader.list_templates())
+                if "all_templates" in flags
+                else None
+            ),
+        }
+        return _hash(json.dumps(inputs, sort_keys=True, default=repr).encode("utf-8"))
+
+    def _get_all_dependencies(
+        self, environment: tutor_env.JinjaEnvironment, template_name: str
+    ) -> t.Optional[tuple[dict[str, str], set[str], set[str], set[str]]]:
+        """
+        Follow a template's includes and patches, recursively, and collect the
+        hashes of all sources involved, plus the variables, patches, and flags
+        that they use. Returns None if the template has dynamic dependencies.
+        """
+        sources: dict[str, str] = {}
+        variables: set[str] = set()
+        patch_names: set[str] = set()
+        flags: set[str] = set()
+        pending_templates = [template_name]
+        pending_texts: list[str] = []
+        while pending_templates or pending_texts:
+            if pending_templates:
+                name = pending_templates.pop()
+                if name in sources:
+                    continue
+                text = environment.read_str(name)
+                sources[name] = _hash(text.encode("utf-8"))
+            else:
+                text = pending_texts.pop()
+            dependencies = self._get_dependencies(environment, text)
+            if dependencies["dynamic"]:
+                return None
+            variables.update(dependencies["variables"])
+            flags.update(dependencies["flags"])
+            pending_templates += dependencies["templates"]
+            new_patch_names = set(
+                _all_patch_names()
+                if "all_patches" in dependencies["flags"]
+                else dependencies["patches"]
             )
-        except CalledProcessError as exc:
-            click.echo(
-                "------------------------------------------------------------", err=True
+            for patch_name in new_patch_names - patch_names:
+                pending_texts += hooks.Filters.ENV_PATCH(patch_name).iterate()
+            patch_names |= new_patch_names
+        return sources, variables, patch_names, flags
+
+    def _get_dependencies(
+        self, environment: jinja2.Environment, text: str
+    ) -> dict[str, t.Any]:
+        """
+        Statically analyze a template (or patch) for everything its rendering depends on.
+        """
+        text_hash = _hash(text.encode("utf-8"))
+        if text_hash in self._dependencies:
+            return self._dependencies[text_hash]
+        # pylint: disable=import-outside-toplevel
+        import jinja2.meta
+        from jinja2 import nodes
+
+        ast = environment.parse(text)
+        templates = list(jinja2.meta.find_referenced_templates(ast))
+        patches: list[str] = []
+        flags: list[str] = []
+        dynamic = None in templates
+        for call in ast.find_all(nodes.Call):
+            if isinstance(call.node, nodes.Name) and call.node.name == "patch":
+                if call.args and isinstance(call.args[0], nodes.Const):
+                    patches.append(call.args[0].value)
+                else:
+                    flags.append("all_patches")
+        for filter_ in ast.find_all(nodes.Filter):
+            if filter_.name == "walk_templates":
+                flags.append("all_templates")
+        variables = sorted(jinja2.meta.find_undeclared_variables(ast))
+        if "iter_values_named" in variables:
+            flags.append("all_config")
+        dependencies = {
+            "variables": variables,
+            "templates": [name for name in templates if name is not None],
+            "patches": patches,
+            "flags": flags,
+            "dynamic": dynamic,
+        }
+        self._dependencies[text_hash] = dependencies
+        return dependencies
+
+
+def _all_patch_names() -> list[str]:
+    return sorted({name for name, _content in hooks.Filters.ENV_PATCHES.iterate()})
+
+
+def _hash(content: bytes) -> str:
+    import hashlib  # pylint: disable=import-outside-toplevel
+
+    return hashlib.sha256(content).hexdigest()
+
+
+def _stat_signature(path: Path) -> t.Optional[list[int]]:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class _FileDiff(t.NamedTuple):
+    """
+    A difference between the current environment and the updated environment.
+    """
+
+    path: str  # Relative to the env directory.
+    status: str  # "added", "removed", or "changed".
+    diff: t.Optional[str]  # Unified diff, or None for binary files.
+
+    @property
+    def hunks(self) -> int:
+        """
+        The number of hunks in the diff (0 for binary files).
+        """
+        return 0 if self.diff is None else self.diff.count("\n@@ ")
+
+
+def _diff_rendered_against_env(
+    rendered: dict[str, t.Union[str, bytes]], env_root: Path
+) -> list[_FileDiff]:
+    """
+    Compare the rendered env against the on-disk env.
+
+    Files that exist on disk but were not rendered are ignored, since
+    `tutor config save` never deletes anything either.
+    """
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    def diff_file(path: str) -> t.Optional[_FileDiff]:
+        content = rendered[path]
+        # Tutor writes text files as UTF-8 with Unix newlines.
+        after = content if isinstance(content, bytes) else content.encode("utf-8")
+        try:
+            before: t.Optional[bytes] = (env_root / path).read_bytes()
+        except FileNotFoundError:
+            before = None
+        if before == after:
+            return None
+        return _make_file_diff(path, before, after, binary=isinstance(content, bytes))
+
+    with ThreadPoolExecutor() as executor:
+        results = executor.map(diff_file, sorted(rendered))
+    return [file_diff for file_diff in results if file_diff]
+
+
+def _diff_trees(before_root: Path, after_root: Path) -> list[_FileDiff]:
+    """
+    Compare two directory trees, using a thread pool.
+
+    Files with identical sizes & modification times are assumed to be unchanged.
+    Other files with identical sizes are hashed to see whether they really differ.
+    Only files that differ are read in full in order to generate a diff.
+    """
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor() as executor:
+        before_files, after_files = executor.map(_list_files, [before_root, after_root])
+
+        def diff_file(path: str) -> t.Optional[_FileDiff]:
+            before = before_files.get(path)
+            after = after_files.get(path)
+            if before and after:
+                if before.st_size == after.st_size and (
+                    before.st_mtime_ns == after.st_mtime_ns
+                    or _hash_file(before_root / path) == _hash_file(after_root / path)
+                ):
+                    return None
+            before_content = (before_root / path).read_bytes() if before else None
+            after_content = (after_root / path).read_bytes() if after else None
+            return _make_file_diff(path, before_content, after_content)
+
+        results = executor.map(
+            diff_file, sorted(before_files.keys() | after_files.keys())
+        )
+        return [file_diff for file_diff in results if file_diff]
+
+
+def _list_files(root: Path) -> dict[str, os.stat_result]:
+    """
+    Map the relative paths of all files under a directory to their stats.
+    """
+    files: dict[str, os.stat_result] = {}
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            files[os.path.relpath(path, root)] = os.stat(path)
+    return files
+
+
+def _clone_missing_files(src_root: Path, dst_root: Path) -> None:
+    """
+    Recreate every file from `src_root` that does not yet exist in `dst_root`.
+
+    Files are reflinked (copy-on-write) where the filesystem supports it, otherwise
+    they are hardlinked, and otherwise they are copied. Hardlinking is safe
+    here because these files are never written to afterwards.
+    """
+    can_reflink = fcntl is not None
+    can_hardlink = True
+    for path in _list_files(src_root):
+        src = src_root / path
+        dst = dst_root / path
+        if dst.exists():
+            continue
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if can_reflink:
+            try:
+                _reflink(src, dst)
+                continue
+            except OSError as exc:
+                if dst.exists():
+                    dst.unlink()
+                if exc.errno in _REFLINK_UNSUPPORTED_ERRNOS:
+                    can_reflink = False
+        if can_hardlink:
+            try:
+                os.link(src, dst)
+                continue
+            except OSError:
+                can_hardlink = False
+        shutil.copy2(src, dst)
+
+
+# Linux FICLONE ioctl request number, from <linux/fs.h>.
+_FICLONE = 0x40049409
+_REFLINK_UNSUPPORTED_ERRNOS = {
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EBADF,
+}
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    """
+    Clone `src` to `dst` using a copy-on-write reflink (Btrfs, XFS, etc.).
+    """
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+    shutil.copystat(src, dst)
+
+
+def _hash_file(path: Path) -> str:
+    import hashlib  # pylint: disable=import-outside-toplevel
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _make_file_diff(
+    path: str,
+    before: t.Optional[bytes],
+    after: t.Optional[bytes],
+    binary: bool = False,
+) -> _FileDiff:
+    import difflib  # pylint: disable=import-outside-toplevel
+
+    status = "added" if before is None else "removed" if after is None else "changed"
+    try:
+        before_lines = (before or b"").decode("utf-8").splitlines(keepends=True)
+        after_lines = (after or b"").decode("utf-8").splitlines(keepends=True)
+    except UnicodeDecodeError:
+        binary = True
+    if binary:
+        return _FileDiff(path, status, None)
+    diff = "".join(
+        difflib.unified_diff(
+            before_lines,
+            after_lines,
+            fromfile=f"before/env/{path}" if before is not None else "/dev/null",
+            tofile=f"after/env/{path}" if after is not None else "/dev/null",
+        )
+    )
+    return _FileDiff(path, status, diff)
+
+
+def _echo_file_diffs(file_diffs: list[_FileDiff], output_format: str) -> None:
+    if output_format == "json":
+        click.echo(
+            json.dumps(
+                {
+                    "up_to_date": not file_diffs,
+                    **{
+                        status: [
+                            {"path": file_diff.path, "hunks": file_diff.hunks}
+                            if status == "changed"
+                            else file_diff.path
+                            for file_diff in file_diffs
+                            if file_diff.status == status
+                        ]
+                        for status in ["added", "removed", "changed"]
+                    },
+                },
+                indent=2,
             )
-            click.echo(exc.output.decode("utf-8"), err=True)
+        )
+        return
+    for file_diff in file_diffs:
+        if file_diff.diff is None:
             click.echo(
-                "------------------------------------------------------------", err=True
-            )
-            raise click.ClickException(
-                "Failed to run `tutor config save. Output is captured above."
-            )  # pylint: disable=raise-missing-from
-        try:
-            run(
-                ["diff", before / "env", after / "env"],
-                cwd=str(compare_root),
-                check=True,
+                f"Binary files before/env/{file_diff.path} "
+                f"and after/env/{file_diff.path} differ"
             )
-        except CalledProcessError as exc:
-            # When diff exits 1, it just means that there was a difference.
-            # The output will have been printed to the console.
-            # Otherwise, any other return code implies that an error occurred.
-            if exc.returncode != 1:
-                raise
         else:
-            # When diff exits 0, it means there was no difference.
-            click.echo("Your Tutor environment is up to date.", err=True)
-
-    hooks.Filters.CLI_COMMANDS.add_item(configdiff)
+            click.echo(file_diff.diff, nl=False)
+    if not file_diffs:
+        click.echo("Your Tutor environment is up to date.", err=True)
@@ -0,0 +1,371 @@
+"""
+A minimal client for the Docker Engine API, shared by the plugins in this package.
+
+This isn't a plugin itself. It exists so that we can do targeted operations
+(like "stop just the containers that use these volumes") without shelling out
+to `docker` or `docker compose` for each step, and without depending on the
+`docker` Python package.
+
+By default, it talks to the daemon at $DOCKER_HOST, or else /var/run/docker.sock.
+Any socket path can be passed in instead, such as that of a stand-in server.
+
+The plugins import this module on every `tutor` invocation, so the networking
+and archive modules are only imported once a request is actually made.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import typing as t
+import urllib.parse
+
+from . import tracing
+
+if t.TYPE_CHECKING:
+    import http.client
+    import tarfile
+
+DEFAULT_SOCKET_PATH = "/var/run/docker.sock"
+
+
+class DockerApiError(Exception):
+    """
+    The Docker daemon responded with an error status.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+
+
+class DockerClient:
+    """
+    Just enough of the Docker Engine API for our purposes.
+    """
+
+    def __init__(self, socket_path: t.Optional[str] = None, timeout: float = 60):
+        self.timeout = timeout
+        self.socket_path = socket_path
+        self.tcp_address: t.Optional[str] = None
+        if socket_path is None:
+            docker_host = os.environ.get("DOCKER_HOST", "")
+            if docker_host.startswith("tcp://"):
+                self.tcp_address = docker_host[len("tcp://") :]
+            elif docker_host.startswith("unix://"):
+                self.socket_path = docker_host[len("unix://") :]
+            else:
+                self.socket_path = DEFAULT_SOCKET_PATH
+
+    def _connect(self) -> http.client.HTTPConnection:
+        # pylint: disable=import-outside-toplevel,redefined-outer-name
+        import http.client
+        import socket
+
+        if self.tcp_address:
+            return http.client.HTTPConnection(self.tcp_address, timeout=self.timeout)
+        # An HTTP connection over a unix socket rather than TCP: connections which
+        # already have a socket don't try to open one themselves.
+        connection = http.client.HTTPConnection("localhost", timeout=self.timeout)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(t.cast(str, self.socket_path))
+        except OSError:
+            sock.close()
+            raise
+        connection.sock = sock
+        return connection
+
+    @staticmethod
+    def _check_status(status: int, body: bytes) -> None:
+        if status >= 400:
+            try:
+                message = json.loads(body)["message"]
+            except (ValueError, KeyError, TypeError):
+                message = body.decode("utf-8", errors="replace")
+            raise DockerApiError(status, message)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        query: t.Optional[dict[str, t.Any]] = None,
+        data: t.Any = None,
+    ) -> t.Any:
+        """
+        Make a request (with an optional JSON body), and return the decoded JSON
+        response (or None if empty).
+        """
+        headers = {"Host": "docker"}
+        body = None
+        if data is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(data).encode("utf-8")
+        with tracing.span(f"{method} {path}", "docker", query=query) as span_args:
+            if query:
+                path += "?" + urllib.parse.urlencode(query)
+            connection = self._connect()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response_body = response.read()
+            finally:
+                connection.close()
+            span_args["status"] = response.status
+        self._check_status(response.status, response_body)
+        return json.loads(response_body) if response_body.strip() else None
+
+    def image_id(self, image: str) -> t.Optional[str]:
+        """
+        Get the ID of a local image, or None if it isn't available locally.
+        """
+        try:
+            return self.request(
+                "GET", f"/images/{urllib.parse.quote(image, safe='/:@')}/json"
+            )["Id"]
+        except DockerApiError as exc:
+            if exc.status == 404:
+                return None
+            raise
+
+    def containers_using_volumes(self, volume_names: list[str]) -> list[dict]:
+        """
+        List all containers (running or not) which mount any of the given volumes.
+        """
+        if not volume_names:
+            return []
+        return self.request(
+            "GET",
+            "/containers/json",
+            {"all": "true", "filters": json.dumps({"volume": volume_names})},
+        )
+
+    def running_compose_containers(self) -> list[dict]:
+        """
+        List all running containers which belong to a Compose project.
+        """
+        return self.request(
+            "GET",
+            "/containers/json",
+            {"filters": json.dumps({"label": ["com.docker.compose.project"]})},
+        )
+
+    def stop_container(self, container_id: str, timeout: int = 10) -> None:
+        """
+        Stop a container, unless it's already stopped or gone.
+        """
+        try:
+            self.request("POST", f"/containers/{container_id}/stop", {"t": timeout})
+        except DockerApiError as exc:
+            # A 304 response (already stopped) is not an error. A 404 means that
+            # the container is already gone.
+            if exc.status != 404:
+                raise
+
+    def remove_container(self, container_id: str) -> None:
+        """
+        Delete a container, unless it's already gone.
+
+        Its anonymous volumes (such as those for the image's VOLUME declarations,
+        which are populated from the image) are deleted along with it.
+        """
+        try:
+            self.request("DELETE", f"/containers/{container_id}", {"v": "true"})
+        except DockerApiError as exc:
+            if exc.status != 404:
+                raise
+
+    def create_container(self, image: str, binds: list[str]) -> str:
+        """
+        Create (but don't start) a container with the given "volume:path" binds.
+
+        Returns the container's ID.
+        """
+        return self.request(
+            "POST",
+            "/containers/create",
+            data={"Image": image, "HostConfig": {"Binds": binds}},
+        )["Id"]
+
+    @contextlib.contextmanager
+    def get_archive(self, container_id: str, path: str) -> t.Iterator[t.BinaryIO]:
+        """
+        Stream a tar archive of a path within a container (which needn't be running).
+        """
+        with tracing.span(
+            f"GET /containers/{container_id}/archive", "docker", path=path
+        ) as span_args:
+            connection = self._connect()
+            try:
+                connection.request(
+                    "GET",
+                    f"/containers/{container_id}/archive?"
+                    + urllib.parse.urlencode({"path": path}),
+                    headers={"Host": "docker"},
+                )
+                response = connection.getresponse()
+                span_args["status"] = response.status
+                if response.status >= 400:
+                    self._check_status(response.status, response.read())
+                yield t.cast(t.BinaryIO, response)
+            finally:
+                connection.close()
+
+    def put_archive(self, container_id: str, path: str, archive: t.BinaryIO) -> None:
+        """
+        Stream a tar archive from a file object, and extract it at a path within
+        a container (which needn't be running).
+        """
+        with tracing.span(
+            f"PUT /containers/{container_id}/archive", "docker", path=path
+        ) as span_args:
+            connection = self._connect()
+            connection.blocksize = 1024 * 1024
+            try:
+                connection.request(
+                    "PUT",
+                    f"/containers/{container_id}/archive?"
+                    + urllib.parse.urlencode({"path": path}),
+                    body=archive,
+                    headers={
+                        "Host": "docker",
+                        "Content-Type": "application/x-tar",
+                        "Transfer-Encoding": "chunked",
+                    },
+                    encode_chunked=True,
+                )
+                response = connection.getresponse()
+                response_body = response.read()
+            finally:
+                connection.close()
+            span_args["status"] = response.status
+        self._check_status(response.status, response_body)
+
+    def put_archive_from(
+        self,
+        container_id: str,
+        path: str,
+        write_archive: t.Callable[[tarfile.TarFile], None],
+    ) -> None:
+        """
+        Like put_archive, but stream the tar archive straight from a function which
+        writes to it, without buffering the whole archive.
+        """
+        # pylint: disable=import-outside-toplevel,redefined-outer-name
+        import tarfile
+        from concurrent.futures import ThreadPoolExecutor
+
+        read_fd, write_fd = os.pipe()
+
+        def _write() -> None:
+            with os.fdopen(write_fd, "wb") as pipe, tarfile.open(
+                fileobj=pipe, mode="w|", format=tarfile.PAX_FORMAT
+            ) as tar:
+                write_archive(tar)
+
+        # The reader is closed first, so if the upload fails, then the writer
+        # fails too (with a broken pipe) instead of blocking forever.
+        with ThreadPoolExecutor(max_workers=1) as executor, os.fdopen(
+            read_fd, "rb"
+        ) as reader:
+            written = executor.submit(_write)
+            self.put_archive(container_id, path, t.cast(t.BinaryIO, reader))
+        written.result()
+
+    def run_container(
+        self, image: str, command: list[str], binds: list[str], working_dir: str
+    ) -> int:
+        """
+        Run a command in a new container, wait for it, and remove the container.
+
+        Returns the command's exit code.
+        """
+        container_id = self.request(
+            "POST",
+            "/containers/create",
+            data={
+                "Image": image,
+                "Entrypoint": command[:1],
+                "Cmd": command[1:],
+                "WorkingDir": working_dir,
+                "HostConfig": {"Binds": binds},
+            },
+        )["Id"]
+        try:
+            self.request("POST", f"/containers/{container_id}/start")
+            return self.request("POST", f"/containers/{container_id}/wait")[
+                "StatusCode"
+            ]
+        finally:
+            self.remove_container(container_id)
+
+    def volume_exists(self, volume_name: str) -> bool:
+        """
+        Check whether a volume exists.
+        """
+        try:
+            self.request("GET", f"/volumes/{urllib.parse.quote(volume_name)}")
+        except DockerApiError as exc:
+            if exc.status == 404:
+                return False
+            raise
+        return True
+
+    def create_volume(self, volume_name: str, labels: dict[str, str]) -> None:
+        """
+        Create a volume with the given labels.
+        """
+        self.request(
+            "POST", "/volumes/create", data={"Name": volume_name, "Labels": labels}
+        )
+
+    def remove_volume(self, volume_name: str) -> bool:
+        """
+        Delete a volume. Return False if it did not exist.
+        """
+        try:
+            self.request("DELETE", f"/volumes/{urllib.parse.quote(volume_name)}")
+        except DockerApiError as exc:
+            if exc.status == 404:
+                return False
+            raise
+        return True
+
+    def volume_sizes(self) -> dict[str, int]:
+        """
+        Get the disk usage, in bytes, of every volume.
+
+        Docker reports -1 for volumes whose size it could not compute; we report 0.
+        """
+        usage = self.request("GET", "/system/df")
+        return {
+            volume["Name"]: max(0, (volume.get("UsageData") or {}).get("Size", 0))
+            for volume in usage.get("Volumes") or []
+        }
+
+    def remove_volumes_and_their_containers(self, volume_names: list[str]) -> list[str]:
+        """
+        Stop & remove only the containers that use the given volumes, and then delete
+        the volumes, doing each step in parallel.
+
+        Returns the names of the volumes that existed and were deleted.
+        """
+        # pylint: disable=import-outside-toplevel
+        from concurrent.futures import ThreadPoolExecutor
+
+        containers = self.containers_using_volumes(volume_names)
+        with ThreadPoolExecutor() as executor:
+            list(
+                executor.map(
+                    lambda container: self.stop_container(container["Id"]), containers
+                )
+            )
+            list(
+                executor.map(
+                    lambda container: self.remove_container(container["Id"]),
+                    containers,
+                )
+            )
+            removed = list(executor.map(self.remove_volume, volume_names))
+        return [name for name, existed in zip(volume_names, removed) if existed]
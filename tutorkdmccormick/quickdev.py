@@ -6,17 +6,45 @@ that need to quickly run edx-platform with modified requirement pins and/or
 local package changes.
 
 See this repository's README.rst for a full description of this plugin.
+
+Importing this module happens on every `tutor` invocation, so modules which are
+only needed by particular commands (Jinja, compression, threads...) are imported
+where they're used.
 """
 from __future__ import annotations
 
-import subprocess
+import json
+import os
+import time
 import typing as t
 
 import click
 from tutor import hooks
 
+from . import bench, snapshots, tracing
+from .dockerapi import DockerApiError
+from .volumes import (
+    CACHE_VOLUMES,
+    NODE_REQUIREMENT_VOLUMES,
+    PYTHON_REQUIREMENT_VOLUMES,
+    SINGLE_ASSET_VOLUME,
+    STATIC_ASSET_VOLUMES,
+    asset_volumes,
+    delete_generation,
+    delete_volumes,
+    generation_sizes,
+    image_generation,
+    load_config,
+    load_generations,
+    named_volumes,
+    populate_single_asset_volume,
+    save_generations,
+    volume_key,
+)
+
 
 @hooks.Filters.COMPOSE_MOUNTS.add()
+@tracing.traced
 def _mount_edx_platform_packages(
     volumes: list[tuple[str, str]], name: str
 ) -> list[tuple[str, str]]:
@@ -61,92 +89,65 @@ def _mount_edx_platform_packages(
     return volumes
 
 
-# USE NAMED VOLUMES FOR REQUIREMENTS
-#
-# Background:
-# A "named volume" is a type of Docker volume. It's similar to bind-mount
-# volumes, except that we cannot access its contents easily via the host
-# filesystem. The contents are stored in a Docker-internal fashion, and
-# the volume itself is referred by an identifier that we provide in
-# the docker-compose YAML file. They are ideal for situations where
-# containers need to read and write shared data, but the host doesn't
-# need to modify the data. For writing, they outperform the
-# layered container filesystem significantly, and on macOS and Windows
-# they also outperform bind-mounts.
-#
-# Here, we use named volumes for three things:
-# * Python requirements (the virtualenv and the .egg-info file).
-# * NPM requirements (node_modules).
-# * Generated static assets (various edx-platform folders).
-#
-# This helps users because:
-# * Changes to requirements & assets can be persisted and shared between
-#   all lms* and cms* containers, _without_ having to
-#   either rebuild the image (which takes time) or manage
-#   mounted virtual environments (which is cumbersome and confusing).
-# * Writing to any of these volumes is faster than writing either
-#   directly to the container or to the bind-mounted edx-platform
-#   directory.
+# The volumes in which we keep requirements and assets, and their generations, are
+# described in volumes.py.
+hooks.Filters.CONFIG_DEFAULTS.add_items(
+    [
+        ("QUICKDEV_SINGLE_ASSET_VOLUME", False),
+        ("QUICKDEV_IMAGE_GENERATIONS", True),
+        ("QUICKDEV_MAX_GENERATIONS", 3),
+        ("QUICKDEV_MAX_GENERATIONS_SIZE", 0),
+    ]
+)
+
+
+# VENV MANIFEST
 #
-# Notes:
-# * These declarations are volume "placeholders".
-#   They are associated with actual named volumes via
-#   Tutor's docker-compose YAML files (which we patch below).
-# * When a container is started: if the assigned named
-#   volume exists, then it will be used; if not, a new
-#   volume will be created and pre-populated with the original
-#   contents of this directory from the image. This is extremely
-#   useful for us, because it means that the volumes by-default
-#   have the requirements that are built into the dev image!
-# * Yes, the volumes within /openedx/edx-platform/
-#   will point at their named volumes, *even if* a user bind-mounts
-#   their own repository to /openedx/edx-platform! The volumes
-#   just seem to be layered on top of one another so that in
-#   any given folder, the most specific volume "wins".
-# * These are all generated (that is, not git-managed) files,
-#   with the minor exception of /openedx/edx-platform/lms/static/css,
-#   which contains a git-managed 'vendor' folder. While it would be
-#   best to move 'vendor' out of the volume so that edx-platform developers
-#   can modify the folder and see their changes reflected, we are leaving
-#   this as a TODO for now, since that folder hasn't been touched
-#   in 7+ years and doesn't seem like something we should get hung
-#   up on right now.
-PYTHON_REQUIREMENT_VOLUMES: dict[str, str] = {
-    "openedx_venv": "/openedx/venv",
-    "openedx_egg_info": "/openedx/edx-platform/Open_edX.egg-info",
-}
-NODE_REQUIREMENT_VOLUMES: dict[str, str] = {
-    "openedx_node_modules": "/openedx/edx-platform/node_modules",
-}
-STATIC_ASSET_VOLUMES: dict[str, str] = {
-    # Yeah, there are seven different edx-platform directories
-    # for generated static assets. Gross. It's be nice to
-    # work upstream to simplify this.
-    "openedx_common_static_bundles": "/openedx/edx-platform/common/static/bundles",
-    "openedx_common_static_common_css": "/openedx/edx-platform/common/static/common/css",
-    "openedx_common_static_common_js_vendor": (
-        "/openedx/edx-platform/common/static/common/js/vendor"
-    ),
-    "openedx_common_static_xmodule": "/openedx/edx-platform/common/static/xmodule",
-    "openedx_lms_static_certificates_css": "/openedx/edx-platform/lms/static/certificates/css",
-    # note: /openedx/edx-platform/lms/static/css/vendor is git-managed,
-    #       unlike all the other directories here. The folder hasn't changed
-    #       in git in 7+ years, so I'm not too concerned about the
-    #       fact that it's getting sucked into the named volume.
-    "openedx_lms_static_css": "/openedx/edx-platform/lms/static/css",
-    "openedx_cms_static_css": "/openedx/edx-platform/cms/static/css",
-}
-ALL_NAMED_VOLUMES: dict[str, str] = {
-    **PYTHON_REQUIREMENT_VOLUMES,
-    **NODE_REQUIREMENT_VOLUMES,
-    **STATIC_ASSET_VOLUMES,
-}
+# At build time, we record each Python distribution installed in the image, so that
+# `tutor quickdev pip-restore --only-drifted` can later tell which distributions in
+# the openedx_venv volume have drifted from the image, and repair just those. Each
+# distribution is recorded under its canonical name, as a list of:
+# [version, SHA-256 of its RECORD file, contents of its direct_url.json, location].
+# The manifest lives outside of the venv, so that it always describes the image.
+VENV_MANIFEST = "/openedx/quickdev-venv-manifest.json"
+VENV_MANIFEST_DISTRIBUTION_NAME = "re.sub('[-_.]+', '-', d.metadata['Name']).lower()"
+VENV_MANIFEST_EXPRESSION = (
+    f"{{{VENV_MANIFEST_DISTRIBUTION_NAME}: ["
+    "d.version, "
+    "hashlib.sha256((d.read_text('RECORD') or '').encode()).hexdigest(), "
+    "d.read_text('direct_url.json'), "
+    "os.path.abspath(d.locate_file(''))"
+    "] for d in importlib.metadata.distributions() if d.metadata['Name']}"
+)
 
 # Add volumes to 'development' stage of Dockerfile.
+# Patches are rendered as templates, so the asset volume layout depends on the config.
 DOCKERFILE_PATCH: str = "\n".join(
     [
         "##### BEGIN QUICKDEV PATCH #####",
         "RUN mkdir -p /openedx/mounted-packages",  # For auto-bind-mounted platform packages.
+        # Create cache directories so that they're owned by 'app' rather than by root
+        # when their named volumes are first mounted.
+        f"RUN mkdir -p {' '.join(CACHE_VOLUMES.values())}",
+        # Record the image's Python distributions (see VENV_MANIFEST above).
+        'RUN python -c "import hashlib, importlib.metadata, json, os, re; '
+        f"json.dump({VENV_MANIFEST_EXPRESSION}, open('{VENV_MANIFEST}', 'w'))\"",
+        "{% if QUICKDEV_SINGLE_ASSET_VOLUME %}",
+        # Move the assets into the single asset volume's directory structure, leaving
+        # empty directories behind, on which the volume's subpaths are mounted.
+        " && \\\n    ".join(
+            [
+                f"RUN mkdir -p {SINGLE_ASSET_VOLUME['openedx_static_assets']}",
+                *[
+                    f"mkdir -p {container_path} && "
+                    f"mv {container_path} "
+                    f"{SINGLE_ASSET_VOLUME['openedx_static_assets']}/{volume_name} && "
+                    f"mkdir {container_path}"
+                    for volume_name, container_path in STATIC_ASSET_VOLUMES.items()
+                ],
+            ]
+        ),
+        "{% endif %}",
         *[
             # Declare each volume mount point.
             # Docker will expect a volume to be associated with each of these
@@ -155,8 +156,22 @@ DOCKERFILE_PATCH: str = "\n".join(
             # volume will be populated with the original contents of the same
             # directory from the image.
             f"VOLUME {container_path}"
-            for _volume_name, container_path in ALL_NAMED_VOLUMES.items()
+            for _volume_name, container_path in {
+                **PYTHON_REQUIREMENT_VOLUMES,
+                **NODE_REQUIREMENT_VOLUMES,
+            }.items()
+        ],
+        "{% if QUICKDEV_SINGLE_ASSET_VOLUME %}",
+        *[
+            f"VOLUME {container_path}"
+            for _volume_name, container_path in SINGLE_ASSET_VOLUME.items()
+        ],
+        "{% else %}",
+        *[
+            f"VOLUME {container_path}"
+            for _volume_name, container_path in STATIC_ASSET_VOLUMES.items()
         ],
+        "{% endif %}",
         "#####  END QUICKDEV PATCH  #####",
     ]
 )
@@ -168,39 +183,81 @@ hooks.Filters.ENV_PATCHES.add_item(
 )
 
 
-@hooks.Filters.COMPOSE_DEV_TMP.add()
-def _add_volumes_to_openedx_services(docker_compose_tmp: dict) -> dict:
-    return _add_volumes_to_services(
-        docker_compose_tmp,
-        ALL_NAMED_VOLUMES,
-        ["lms", "cms", "lms-worker", "cms-worker"],
-    )
+@hooks.Actions.PROJECT_ROOT_READY.add()
+@tracing.traced
+def _add_volumes_to_compose_files(root: str) -> None:
+    """
+    Mount our named volumes in the lms* & cms* services, and in their jobs.
 
+    Which volumes are mounted, and their generation, depend on the config, but
+    compose filters aren't given the config. So, they're added once we know the
+    project root, and they load the few settings they need themselves.
+    """
 
-@hooks.Filters.COMPOSE_DEV_JOBS_TMP.add()
-def _add_volumes_to_openedx_jobs_services(docker_compose_tmp: dict) -> dict:
-    return _add_volumes_to_services(
-        docker_compose_tmp, ALL_NAMED_VOLUMES, ["lms-job", "cms-job"]
-    )
+    @hooks.Filters.COMPOSE_DEV_TMP.add()
+    @tracing.traced
+    def _add_volumes_to_openedx_services(docker_compose_tmp: dict) -> dict:
+        return _add_volumes_to_services(
+            docker_compose_tmp,
+            _load_compose_config(root),
+            ["lms", "cms", "lms-worker", "cms-worker"],
+        )
+
+    @hooks.Filters.COMPOSE_DEV_JOBS_TMP.add()
+    @tracing.traced
+    def _add_volumes_to_openedx_jobs_services(docker_compose_tmp: dict) -> dict:
+        # Jobs may run before the single asset volume has been populated for the
+        # services, so they mount it as a whole, which populates it.
+        return _add_volumes_to_services(
+            docker_compose_tmp,
+            _load_compose_config(root),
+            ["lms-job", "cms-job"],
+            mount_whole_asset_volume=True,
+        )
 
 
 def _add_volumes_to_services(
-    compose_file: dict, volumes: dict[str, str], service_names: list[str]
+    compose_file: dict,
+    config: t.Mapping[str, t.Any],
+    service_names: list[str],
+    mount_whole_asset_volume: bool = False,
 ) -> dict:
     """
     Add named volumes to certain services in a docker-compose file.
     """
+    volumes = {**named_volumes(config), **CACHE_VOLUMES}
+    # Each volume is keyed relative to the project, so the same compose file
+    # is valid whichever project it's rendered for.
+    keys = {volume_name: volume_key(config, volume_name) for volume_name in volumes}
+    mounts: list[t.Union[str, dict[str, t.Any]]] = [
+        f"{keys[volume_name]}:{container_path}"
+        for volume_name, container_path in volumes.items()
+        if volume_name not in SINGLE_ASSET_VOLUME or mount_whole_asset_volume
+    ]
+    if config.get("QUICKDEV_SINGLE_ASSET_VOLUME"):
+        # Compose's short syntax doesn't support subpaths.
+        mounts += [
+            {
+                "type": "volume",
+                "source": keys["openedx_static_assets"],
+                "target": container_path,
+                "volume": {"subpath": volume_name},
+            }
+            for volume_name, container_path in STATIC_ASSET_VOLUMES.items()
+        ]
     services = compose_file.get("services", {})
     return {
         **compose_file,
         # Add declarations for named volumes.
-        # We map each volume name to '{}' to indicate that's a basic named volume.
+        # Their keys include the generation, so that generations of volumes
+        # are named after images.
         "volumes": {
             **compose_file.get("volumes", {}),
-            **{volume_name: {} for volume_name, _ in volumes.items()},
+            **{key: {} for key in keys.values()},
         },
         # App volume->directory mappings for each named volume for service.
-        # Each mapping is a string in the form "$VOLUME_NAME:$CONTAINER_PATH".
+        # Each mapping is either a string in the form "$VOLUME_KEY:$CONTAINER_PATH",
+        # or a dict for a subpath of the single asset volume.
         "services": {
             **compose_file.get("services", {}),
             **{
@@ -208,10 +265,7 @@ def _add_volumes_to_services(
                     **services.get(service_name, {}),
                     "volumes": [
                         *services.get(service_name, {}).get("volumes", []),
-                        *[
-                            f"{volume_name}:{container_path}"
-                            for volume_name, container_path in volumes.items()
-                        ],
+                        *mounts,
                     ],
                 }
                 for service_name in service_names
@@ -220,6 +274,30 @@ def _add_volumes_to_services(
     }
 
 
+# File, within the openedx_venv volume, recording a hash of each mounted package's
+# metadata as of the last time it was installed. Because it lives in the venv
+# volume, it is discarded along with the venv (e.g., by `quickdev pip-restore`).
+PIP_INSTALL_MOUNTS_LEDGER = "/openedx/venv/.quickdev-pip-install-mounts"
+
+# Files whose contents determine how a package is installed. If none of these
+# change, then re-running `pip install -e` on the package is pointless.
+PACKAGE_METADATA_GLOBS = [
+    "setup.py",
+    "setup.cfg",
+    "pyproject.toml",
+    "requirements*.txt",
+    "requirements/*.txt",
+    "requirements/*.in",
+]
+
+# Shell command which prints the hash of the metadata of the package in the current
+# directory, as recorded in PIP_INSTALL_MOUNTS_LEDGER.
+PACKAGE_METADATA_HASH_COMMAND = (
+    f"cat $(ls -d {' '.join(PACKAGE_METADATA_GLOBS)} 2>/dev/null) </dev/null | "
+    "sha256sum | cut -d' ' -f1"
+)
+
+
 @click.command()
 @click.option(
     "-s",
@@ -229,34 +307,192 @@ def _add_volumes_to_services(
     show_default=True,
     help="Rebuild static assets after installing packages",
 )
-def pip_install_mounts(build_static: bool) -> list[tuple[str, str]]:
+@click.option(
+    "-a",
+    "--all",
+    "reinstall_all",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help=(
+        "Reinstall all packages, even those whose metadata hasn't changed; "
+        "with --build-static, rebuild all static assets, even if their inputs "
+        "haven't changed"
+    ),
+)
+@click.option(
+    "-w",
+    "--wheels",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help=(
+        "Build wheels for all packages in parallel, caching them in a wheelhouse "
+        "volume, and install from those wheels (non-editable)"
+    ),
+)
+def pip_install_mounts(
+    build_static: bool, reinstall_all: bool, wheels: bool
+) -> list[tuple[str, str]]:
     """
     Install all from /openedx/mounted-packages.
+
+    All packages are installed with a single `pip install` command, so that pip
+    only needs to resolve dependencies once. Packages whose metadata is unchanged
+    since they were last installed into the current venv are skipped.
+
+    Similarly, with --build-static, only the asset pipelines whose inputs have
+    changed since they were last built are re-run.
     """
     script = """
 set -eu  # Stricter mode
 
 if [ -z "$(ls /openedx/mounted-packages 2>/dev/null)" ] ; then
 	echo "Directory /openedx/mounted-packages is empty; nothing to install." >&2
-        exit 0
-fi
-
-echo "Installing packages from /openedx/mounted-packages..." >&2
-set -x
+else
+"""
+    if wheels:
+        script += f"""
+python - {_script_arg(
+    reinstall_all=reinstall_all,
+    wheelhouse=CACHE_VOLUMES["openedx_wheelhouse"],
+    ledger=PIP_INSTALL_MOUNTS_LEDGER,
+)} <<'EOF'
+{_script("pip_install_mounts_wheels.py")}
+EOF
+"""
+    else:
+        script += f"""
+LEDGER={PIP_INSTALL_MOUNTS_LEDGER}
+touch "$LEDGER"
+cp "$LEDGER" "$LEDGER.new"
+TO_INSTALL=""
 for PACKAGE in /openedx/mounted-packages/* ; do
-        pip install -e "$PACKAGE"
+        METADATA_HASH="$(cd "$PACKAGE" && {PACKAGE_METADATA_HASH_COMMAND})"
+        if [ {int(reinstall_all)} -eq 0 ] && grep -qxF "$PACKAGE $METADATA_HASH" "$LEDGER" ; then
+                echo "Metadata of $PACKAGE is unchanged; skipping." >&2
+        else
+                TO_INSTALL="$TO_INSTALL -e $PACKAGE"
+                grep -vF "$PACKAGE " "$LEDGER.new" > "$LEDGER.tmp" || true
+                echo "$PACKAGE $METADATA_HASH" >> "$LEDGER.tmp"
+                mv "$LEDGER.tmp" "$LEDGER.new"
+        fi
 done
-set +x
-echo "Done installing packages from /openedx/mounted-packages." >&2
+
+if [ -n "$TO_INSTALL" ] ; then
+        echo "Installing packages from /openedx/mounted-packages..." >&2
+        set -x
+        pip install $TO_INSTALL
+        set +x
+        echo "Done installing packages from /openedx/mounted-packages." >&2
+fi
+# Only update the ledger once the installation has succeeded.
+mv "$LEDGER.new" "$LEDGER"
 """
+    script += "fi\n"
     if build_static:
-        script += "set -x\nopenedx-assets build --env=dev\n"
+        script += f"""
+python - {_script_arg(
+    rebuild_all=reinstall_all,
+    pipelines=ASSET_PIPELINES,
+    fingerprints=ASSET_FINGERPRINTS,
+    asset_dirs=sorted(STATIC_ASSET_VOLUMES.values()),
+)} <<'EOF'
+{_script("build_static.py")}
+EOF
+"""
     return [("lms", script)]
 
 
+# The steps of `openedx-assets build`, in order. For each step, we list the
+# directories it reads from (relative to edx-platform, except that "MOUNTED_PACKAGES"
+# stands for every mounted package), the file extensions it reads, and the later
+# steps which consume its outputs. Pipeline outputs (i.e., the STATIC_ASSET_VOLUMES
+# directories) and node_modules are never considered inputs.
+ASSET_PIPELINES: dict[str, dict[str, t.Any]] = {
+    "xmodule": {
+        "command": ["openedx-assets", "xmodule"],
+        "dirs": ["xmodule", "common/lib/xmodule"],
+        "extensions": [".js", ".scss", ".css"],
+        "downstream": ["webpack", "common", "themes"],
+    },
+    "npm": {
+        "command": ["openedx-assets", "npm"],
+        "dirs": ["."],
+        "files": ["package.json", "package-lock.json"],
+        "downstream": ["webpack", "common", "themes"],
+    },
+    "webpack": {
+        "command": ["openedx-assets", "webpack", "--env=dev"],
+        "dirs": ["lms/static", "cms/static", "common/static", "MOUNTED_PACKAGES"],
+        "extensions": [".js", ".jsx", ".ts", ".tsx", ".json", ".underscore"],
+        "files": ["webpack.common.config.js", "webpack.dev.config.js"],
+        "downstream": [],
+    },
+    "common": {
+        "command": ["openedx-assets", "common"],
+        "dirs": ["lms/static", "cms/static", "common/static", "MOUNTED_PACKAGES"],
+        "extensions": [".scss", ".css"],
+        "downstream": [],
+    },
+    "themes": {
+        "command": ["openedx-assets", "themes"],
+        "dirs": ["/openedx/themes", "lms/static/sass", "cms/static/sass"],
+        "extensions": [".scss", ".css"],
+        "downstream": [],
+    },
+}
+
+# Fingerprints of the inputs of each asset pipeline, as of its last successful run.
+# Stored in an asset volume so that they're discarded with the assets themselves
+# (e.g., by `quickdev static-restore`).
+ASSET_FINGERPRINTS = (
+    STATIC_ASSET_VOLUMES["openedx_common_static_bundles"]
+    + "/.quickdev-asset-fingerprints.json"
+)
+
 hooks.Filters.CLI_DO_COMMANDS.add_item(pip_install_mounts)
 
 
+@click.command()
+@click.option(
+    "-d",
+    "--debounce",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Seconds without any further changes before rebuilding",
+)
+def watch_mounts(debounce: float) -> list[tuple[str, str]]:
+    """
+    Rebuild mounted packages as they change, until interrupted.
+
+    Changes to the packages in /openedx/mounted-packages are collected until none
+    have happened for a little while. Then, only the packages whose metadata
+    actually changed since they were last installed are reinstalled (editable), and
+    only the asset pipelines which read the changed files are re-run.
+    """
+    return [
+        (
+            "lms",
+            f"""
+python - {_script_arg(
+    debounce=debounce,
+    ledger=PIP_INSTALL_MOUNTS_LEDGER,
+    metadata_globs=PACKAGE_METADATA_GLOBS,
+    metadata_hash_command=PACKAGE_METADATA_HASH_COMMAND,
+    pipelines=ASSET_PIPELINES,
+)} <<'EOF'
+{_script("watch_mounts.py")}
+EOF
+""",
+        )
+    ]
+
+
+hooks.Filters.CLI_DO_COMMANDS.add_item(watch_mounts)
+
+
 @click.group()
 def quickdev():
     """
@@ -268,27 +504,178 @@ hooks.Filters.CLI_COMMANDS.add_item(quickdev)
 
 
 @quickdev.command()
-def pip_restore() -> None:
+@click.option(
+    "-d",
+    "--only-drifted",
+    is_flag=True,
+    help=(
+        "Rather than deleting the Python requirement volumes, only uninstall or "
+        "reinstall the distributions which differ from those in the image"
+    ),
+)
+@click.option(
+    "--check-files",
+    is_flag=True,
+    help=(
+        "With --only-drifted, also check every installed file against the hash in "
+        "its distribution's RECORD, to catch in-place edits (slower)"
+    ),
+)
+@click.pass_obj
+def pip_restore(context: t.Any, only_drifted: bool, check_files: bool) -> None:
     """
     Revert to original Python requirements from Docker image.
+
+    By default, the Python requirement volumes are deleted, so that they get
+    re-populated from the image. With --only-drifted, the venv is instead compared
+    against a manifest of the image's distributions (names, versions, and RECORD
+    hashes), and only the distributions that differ are repaired, which is usually
+    much faster after installing or upgrading a handful of packages.
     """
-    _delete_volumes(PYTHON_REQUIREMENT_VOLUMES.keys())
+    if not only_drifted:
+        delete_volumes(load_config(context.root), PYTHON_REQUIREMENT_VOLUMES.keys())
+        return
+    result = tracing.run(
+        [
+            "tutor",
+            "dev",
+            "dc",
+            "run",
+            "--rm",
+            "--no-deps",
+            "-T",
+            "lms",
+            "python",
+            "-c",
+            _script("pip_restore_drifted.py"),
+            json.dumps(
+                {
+                    "check_files": check_files,
+                    "manifest": VENV_MANIFEST,
+                    "manifest_expression": VENV_MANIFEST_EXPRESSION,
+                    "distribution_name": VENV_MANIFEST_DISTRIBUTION_NAME,
+                    "ledger": PIP_INSTALL_MOUNTS_LEDGER,
+                    "wheelhouse": CACHE_VOLUMES["openedx_wheelhouse"],
+                }
+            ),
+        ]
+    )
+    if result.returncode:
+        raise click.ClickException(
+            "Failed to repair the drifted Python distributions (see above). "
+            "To start afresh from the image, run: tutor quickdev pip-restore"
+        )
 
 
 @quickdev.command()
-def npm_restore() -> None:
+@click.pass_obj
+def npm_restore(context: t.Any) -> None:
     """
     Revert to original Node packages from Docker image.
     """
-    _delete_volumes(NODE_REQUIREMENT_VOLUMES.keys())
+    delete_volumes(load_config(context.root), NODE_REQUIREMENT_VOLUMES.keys())
 
 
 @quickdev.command()
-def static_restore() -> None:
+@click.pass_obj
+def static_restore(context: t.Any) -> None:
     """
     Revert to original built assets from the Docker image.
     """
-    _delete_volumes(STATIC_ASSET_VOLUMES.keys())
+    config = load_config(context.root)
+    delete_volumes(config, asset_volumes(config).keys())
+
+
+@quickdev.command()
+@click.pass_obj
+def generations(context: t.Any) -> None:
+    """
+    List generations of volumes, from most to least recently used.
+    """
+    config = load_config(context.root)
+    current = image_generation(config["DOCKER_IMAGE_OPENEDX_DEV"])
+    last_used = load_generations(context.root)
+    sizes = generation_sizes(config, last_used.keys())
+    for generation, timestamp in sorted(
+        last_used.items(), key=lambda item: item[1], reverse=True
+    ):
+        click.echo(
+            f"{generation or '(unsuffixed)'}"
+            f"{' (current)' if generation == current else ''}: "
+            f"last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))}, "
+            f"{sizes[generation] / 1000 / 1000:.1f} MB"
+        )
+
+
+@quickdev.command()
+@click.option(
+    "-m",
+    "--max-size",
+    type=int,
+    default=None,
+    help=(
+        "Size cap for each cache, in MB. If a cache is larger, then its "
+        "least-recently-used entries are deleted until it fits"
+    ),
+)
+def cache(max_size: t.Optional[int]) -> None:
+    """
+    Show usage of the pip & npm cache volumes, and optionally prune them.
+
+    The hit rate is the share of cache entries which have been read at least
+    once since they were written, as judged by their access times. Under the usual
+    'relatime' mount option, only the first read after a write updates the access
+    time, so repeated hits aren't counted. On 'noatime' mounts, access times are
+    never updated, so the hit rate is unavailable, and pruning removes the
+    least-recently-written entries instead.
+    """
+    output = tracing.check_output(
+        [
+            "tutor",
+            "dev",
+            "dc",
+            "run",
+            "--rm",
+            "--no-deps",
+            "-T",
+            "lms",
+            "python",
+            "-c",
+            _script("inspect_caches.py"),
+            json.dumps(
+                {
+                    "paths": CACHE_VOLUMES,
+                    "max_bytes": None if max_size is None else max_size * 1024 * 1024,
+                }
+            ),
+        ]
+    )
+    # Anything printed by the container before the report itself is ignored.
+    report = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    for volume_name, usage in report.items():
+        if usage["hits"] is None:
+            hit_rate = "unavailable (noatime mount)"
+        elif usage["entries"]:
+            hit_rate = f"{100 * usage['hits'] / usage['entries']:.0f}%"
+        else:
+            hit_rate = "-"
+        click.echo(
+            f"{volume_name}: {usage['bytes'] / 1024 / 1024:.1f} MB, "
+            f"{usage['entries']} entries, {hit_rate} hit rate"
+        )
+        if usage["pruned_entries"]:
+            click.echo(
+                f"  pruned {usage['pruned_entries']} least-recently-used entries "
+                f"({usage['pruned_bytes'] / 1024 / 1024:.1f} MB)"
+            )
+
+
+# Snapshots & clones of the named volumes (see snapshots.py), and benchmarks of how
+# quickly the platform starts with them (see bench.py).
+quickdev.add_command(snapshots.snapshot)
+quickdev.add_command(snapshots.restore)
+quickdev.add_command(snapshots.clone_volumes)
+quickdev.add_command(bench.bench)
 
 
 @quickdev.command(
@@ -313,49 +700,109 @@ or this:
     )
 
 
-def _delete_volumes(volume_names: t.Iterable[str]) -> None:
+def _script(filename: str) -> str:
     """
-    Stop containers & delete one or more named `tutor dev` volumes.
+    Load one of the Python scripts which we run within containers, from the
+    'scripts' directory of this package.
+
+    Each script takes its inputs as a single JSON argument.
     """
-    import tutor.__about__ as tutor_about  # pylint: disable=import-outside-toplevel
+    path = os.path.join(os.path.dirname(__file__), "scripts", filename)
+    with open(path, encoding="utf-8") as script_file:
+        return script_file.read()
 
-    # Bring down all `tutor dev` containers so that we can delete volumes.
-    # We must use `down` instead of `stop`, because the latter doesn't bring
-    # down `tutor dev run` containers. Note that `down` also will prune all
-    # stopped containers for us.
-    subprocess.check_call(["tutor", "dev", "dc", "down"])
 
-    # I don't know of a way to delete specific volumes through docker-compose,
-    # so we must hackily build the volume names ourselves based on the compose
-    # project name.
-    compose_project = tutor_about.__app__.replace("-", "_") + "_dev"
-    volume_names = [f"{compose_project}_{volume_name}" for volume_name in volume_names]
-    subprocess.check_call(["docker", "volume", "rm", *volume_names])
+def _script_arg(**inputs: t.Any) -> str:
+    """
+    Quote the JSON argument of a script, for use in a shell command.
+    """
+    import shlex  # pylint: disable=import-outside-toplevel
+
+    return shlex.quote(json.dumps(inputs))
 
 
-# @hooks.Actions.IMAGE_BUILT.add()
-# @hooks.Filters.IMAGE_PULLED.add()
-def _handle_image_change(image: str) -> None:
+def _load_compose_config(root: str) -> dict[str, t.Any]:
     """
-    HYPOTHETICAL: Delete requirement & asset volumes whenever image changes.
+    Load the settings from config.yml (and environment variables) on top of their
+    defaults, rendering only the openedx-dev image, which is much quicker than
+    loading the full config.
+    """
+    # pylint: disable=import-outside-toplevel
+    from tutor import config as tutor_config
+    from tutor import env as tutor_env
+
+    config = tutor_config.get_user(root)
+    tutor_config.update_with_defaults(config)
+    config["DOCKER_IMAGE_OPENEDX_DEV"] = tutor_env.render_unknown(
+        config, config["DOCKER_IMAGE_OPENEDX_DEV"]
+    )
+    return config
+
 
-    The IMAGE_BUILT and IMAGE_PULLED actions do not exist in Tutor (yet),
-    but if they did, we could hook into them in order to smartly delete
-    the named volumes holding our Python virtualenv, node_modules, and generated
-    static assets.
+@hooks.Actions.COMPOSE_PROJECT_STARTED.add()
+@tracing.traced
+def _populate_single_asset_volume(
+    root: str, config: dict[str, t.Any], project_name: str
+) -> None:
+    """
+    Before the services are started, make sure that the single asset volume has been
+    populated from the image, since they only mount sub-directories of it.
+    """
+    # pylint: disable=unused-argument
+    if project_name != config["DEV_PROJECT_NAME"]:
+        return
+    if not config["QUICKDEV_SINGLE_ASSET_VOLUME"]:
+        return
+    try:
+        populate_single_asset_volume(config)
+    except (OSError, DockerApiError) as exc:
+        # Compose will report the missing sub-directories, if need be.
+        click.echo(f"Could not populate the single asset volume: {exc}", err=True)
+
+
+@hooks.Actions.COMPOSE_PROJECT_STARTED.add()
+@tracing.traced
+def _handle_image_change(
+    root: str, config: dict[str, t.Any], project_name: str
+) -> None:
+    """
+    Record that the current image's generation of volumes is in use, and
+    delete the least-recently-used generations if there are too many.
 
     Why?
 
-    If we never delete these volumes, then users will need to remember
+    If we never deleted these volumes, then users would need to remember
     to regularly either (a) upate requirements and static assets, or (b) delete
     the named volumes manually using the `*-restore` commands defined above.
     Many users may find this cumbersome, since they already need to remember
     to tutor-pull new images and git-pull edx-platform regularly.
 
-    So, we should delete the named volumes in an automatic yet also
-    predictable fashion. `tutor images pull/build opnedx` strikes me as a good
-    time to trigger the volume removal, since folks tend to run it when
-    they want a fresh, updated environment.
+    Instead, a new image automatically gets new volumes (populated from
+    the image itself), and volumes for old images are automatically cleaned up.
     """
-    if image == "openedx":
-        _delete_volumes(ALL_NAMED_VOLUMES.keys())
+    if project_name != config["DEV_PROJECT_NAME"]:
+        return
+    if not config["QUICKDEV_IMAGE_GENERATIONS"]:
+        return
+    # This is the generation which the compose files were rendered with, even if
+    # it's "" (unsuffixed), since they were rendered by this same process.
+    current = image_generation(config["DOCKER_IMAGE_OPENEDX_DEV"])
+    last_used = load_generations(root)
+    last_used[current] = time.time()
+
+    # Most-recently-used first. The current generation is never evicted.
+    by_recency = sorted(last_used, key=lambda generation: -last_used[generation])
+    to_keep = [
+        generation
+        for generation in by_recency
+        if generation == current or generation  # Unsuffixed volumes go ASAP.
+    ][: max(1, config["QUICKDEV_MAX_GENERATIONS"])]
+    max_size = config["QUICKDEV_MAX_GENERATIONS_SIZE"] * 1000 * 1000
+    if max_size:
+        sizes = generation_sizes(config, to_keep)
+        while len(to_keep) > 1 and sum(sizes[gen] for gen in to_keep) > max_size:
+            to_keep.pop()
+    for generation in by_recency:
+        if generation not in to_keep and delete_generation(config, generation):
+            del last_used[generation]
+    save_generations(root, last_used)
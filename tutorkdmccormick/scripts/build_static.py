@@ -0,0 +1,82 @@
+# Run by `tutor dev do pip-install-mounts --build-static`.
+# Takes a JSON argument of {"rebuild_all": bool, "pipelines": {name: pipeline},
+# "fingerprints": path, "asset_dirs": [path]}. With "rebuild_all", every asset
+# pipeline is re-run; otherwise, only those whose inputs changed.
+#
+# A pipeline's fingerprint is a hash of the path, size & mtime of each of its input
+# files. Steps are run in `openedx-assets build` order. A step which is re-run causes
+# its downstream steps to be re-run as well.
+import hashlib, json, os, subprocess, sys
+
+args = json.loads(sys.argv[1])
+PIPELINES = args["pipelines"]
+FINGERPRINTS = args["fingerprints"]
+EDX_PLATFORM = "/openedx/edx-platform"
+MOUNTS = "/openedx/mounted-packages"
+EXCLUDED_DIRS = set(args["asset_dirs"]) | {
+    EDX_PLATFORM + "/node_modules",
+}
+
+
+def fingerprint(pipeline):
+    roots = []
+    for path in pipeline["dirs"]:
+        if path == "MOUNTED_PACKAGES":
+            if os.path.isdir(MOUNTS):
+                roots += sorted(
+                    os.path.join(MOUNTS, name) for name in os.listdir(MOUNTS)
+                )
+        else:
+            roots.append(os.path.join(EDX_PLATFORM, path))
+    extensions = tuple(pipeline.get("extensions", []))
+    files = set(pipeline.get("files", []))
+    digest = hashlib.sha256()
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(
+                name
+                for name in dirnames
+                if os.path.join(dirpath, name) not in EXCLUDED_DIRS
+                and name not in (".git", "node_modules")
+            )
+            if not extensions:
+                dirnames.clear()  # Only look for the listed files at the top level.
+            for filename in sorted(filenames):
+                if filename in files or (extensions and filename.endswith(extensions)):
+                    path = os.path.join(dirpath, filename)
+                    stat = os.stat(path)
+                    digest.update(f"{path} {stat.st_size} {stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+rebuild_all = args["rebuild_all"]
+try:
+    with open(FINGERPRINTS) as f:
+        old_fingerprints = json.load(f)
+except (FileNotFoundError, ValueError):
+    old_fingerprints = {}
+
+new_fingerprints = {}
+to_run = set()
+for name, pipeline in PIPELINES.items():
+    new_fingerprints[name] = fingerprint(pipeline)
+    if (
+        rebuild_all
+        or name in to_run
+        or new_fingerprints[name] != old_fingerprints.get(name)
+    ):
+        to_run.add(name)
+        to_run.update(pipeline["downstream"])
+
+if not to_run:
+    print("Static asset inputs are unchanged; skipping asset build.", file=sys.stderr)
+for name, pipeline in PIPELINES.items():
+    if name in to_run:
+        print(
+            "Running asset pipeline: " + " ".join(pipeline["command"]), file=sys.stderr
+        )
+        subprocess.check_call(pipeline["command"], cwd=EDX_PLATFORM)
+        # Save progress after each step, so that a failure doesn't lose it.
+        old_fingerprints[name] = new_fingerprints[name]
+        with open(FINGERPRINTS, "w") as f:
+            json.dump(old_fingerprints, f)
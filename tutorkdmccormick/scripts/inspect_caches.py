@@ -0,0 +1,51 @@
+# Run by `tutor quickdev cache` within a container that has the cache volumes mounted.
+# Takes a JSON argument of {"paths": {volume_name: path}, "max_bytes": int|null}.
+# Prints a JSON report of {volume_name: {"bytes", "entries", "hits", ...}}, where
+# "hits" is null if the volume is mounted with 'noatime', since then access times
+# can't tell us whether an entry was ever read.
+import json, os, sys
+
+
+def mount_options(path):
+    mount_point, options = "", []
+    with open("/proc/self/mountinfo") as f:
+        for line in f:
+            fields = line.split()
+            if (
+                path == fields[4] or path.startswith(fields[4].rstrip("/") + "/")
+            ) and len(fields[4]) > len(mount_point):
+                mount_point, options = fields[4], fields[5].split(",")
+    return options
+
+
+args = json.loads(sys.argv[1])
+report = {}
+for volume_name, root in args["paths"].items():
+    entries = []
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            entries.append((stat.st_atime, stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum(size for _atime, _mtime, size, _path in entries)
+    pruned_entries = pruned_bytes = 0
+    max_bytes = args["max_bytes"]
+    while max_bytes is not None and total > max_bytes and entries:
+        _atime, _mtime, size, path = entries.pop(0)
+        os.remove(path)
+        total -= size
+        pruned_entries += 1
+        pruned_bytes += size
+    report[volume_name] = {
+        "bytes": total,
+        "entries": len(entries),
+        "hits": (
+            None
+            if "noatime" in mount_options(root)
+            else sum(1 for atime, mtime, _size, _path in entries if atime > mtime)
+        ),
+        "pruned_entries": pruned_entries,
+        "pruned_bytes": pruned_bytes,
+    }
+print(json.dumps(report))
@@ -0,0 +1,85 @@
+# Run by `tutor dev do pip-install-mounts --wheels`.
+# Takes a JSON argument of {"reinstall_all": bool, "wheelhouse": path, "ledger": path}.
+# With "reinstall_all", every package is reinstalled; otherwise, unchanged ones
+# are skipped.
+#
+# For each mounted package, in a process pool sized to the container's CPUs:
+# hash the package's source tree, and if the wheelhouse doesn't already have a wheel
+# for that hash, then build one. Then, install all new wheels in one pip command.
+# The ledger records source hashes, so unchanged packages aren't reinstalled.
+import hashlib, json, os, shutil, subprocess, sys, tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+args = json.loads(sys.argv[1])
+WHEELHOUSE = args["wheelhouse"]
+LEDGER = args["ledger"]
+MOUNTS = "/openedx/mounted-packages"
+SKIPPED_DIRS = {".git", "__pycache__", "node_modules", "build", "dist", ".tox"}
+
+
+def source_hash(package):
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(package):
+        dirnames[:] = sorted(
+            name
+            for name in dirnames
+            if name not in SKIPPED_DIRS and not name.endswith(".egg-info")
+        )
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            digest.update(os.path.relpath(path, package).encode())
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def build_wheel(package):
+    package_hash = source_hash(package)
+    wheel_dir = os.path.join(WHEELHOUSE, os.path.basename(package), package_hash)
+    wheels = os.listdir(wheel_dir) if os.path.isdir(wheel_dir) else []
+    if any(wheel.endswith(".whl") for wheel in wheels):
+        print(f"Using cached wheel for {package}.", file=sys.stderr)
+    else:
+        print(f"Building wheel for {package}...", file=sys.stderr)
+        os.makedirs(os.path.dirname(wheel_dir), exist_ok=True)
+        build_dir = tempfile.mkdtemp(dir=os.path.dirname(wheel_dir))
+        subprocess.check_call(
+            ["pip", "wheel", "--no-deps", "--wheel-dir", build_dir, package],
+            stdout=sys.stderr,
+        )
+        shutil.rmtree(wheel_dir, ignore_errors=True)
+        os.rename(build_dir, wheel_dir)
+        wheels = os.listdir(wheel_dir)
+    wheel = next(wheel for wheel in wheels if wheel.endswith(".whl"))
+    return package, package_hash, os.path.join(wheel_dir, wheel)
+
+
+reinstall_all = args["reinstall_all"]
+packages = sorted(os.path.join(MOUNTS, name) for name in os.listdir(MOUNTS))
+with ProcessPoolExecutor(max_workers=len(os.sched_getaffinity(0))) as executor:
+    built = list(executor.map(build_wheel, packages))
+
+ledger = {}
+if os.path.exists(LEDGER):
+    with open(LEDGER) as f:
+        ledger = dict(line.rstrip("\n").split(" ", 1) for line in f if " " in line)
+to_install = []
+for package, package_hash, wheel in built:
+    if not reinstall_all and ledger.get(package) == "wheel-" + package_hash:
+        print(f"Source of {package} is unchanged; skipping.", file=sys.stderr)
+    else:
+        to_install.append(wheel)
+        ledger[package] = "wheel-" + package_hash
+
+if to_install:
+    print("Installing wheels...", file=sys.stderr)
+    # First, resolve and install dependencies for all the wheels at once.
+    # Then, force-reinstall the wheels themselves, since a rebuilt wheel
+    # usually has the same version number as the currently-installed one.
+    subprocess.check_call(["pip", "install", *to_install])
+    subprocess.check_call(
+        ["pip", "install", "--no-deps", "--force-reinstall", *to_install]
+    )
+    print("Done installing wheels.", file=sys.stderr)
+with open(LEDGER, "w") as f:
+    f.writelines(package + " " + value + "\n" for package, value in ledger.items())
@@ -0,0 +1,136 @@
+# Run by `tutor quickdev pip-restore --only-drifted` within an lms container.
+# Takes a JSON argument of {"check_files": bool, "manifest": path,
+# "manifest_expression": str, "distribution_name": str, "ledger": path,
+# "wheelhouse": path}.
+# Compares the venv against the image's manifest, uninstalls distributions which
+# aren't in the image, force-reinstalls those which are missing or differ, and
+# prints a summary. Mounted packages which are uninstalled or overwritten this way
+# are dropped from the pip-install-mounts ledger, so that it reinstalls them.
+#
+# The manifest expression and distribution name are Python expressions, shared with
+# the Dockerfile command which writes the manifest.
+import base64, hashlib, importlib.metadata, json, os, re, subprocess, sys
+import urllib.parse
+
+MOUNTS = "/openedx/mounted-packages"
+
+args = json.loads(sys.argv[1])
+LEDGER = args["ledger"]
+WHEELHOUSE = args["wheelhouse"]
+try:
+    with open(args["manifest"]) as f:
+        image = json.load(f)
+except FileNotFoundError:
+    sys.exit(
+        "This openedx-dev image has no manifest of its Python distributions, "
+        "so it must have been built before --only-drifted existed. "
+        "Rebuild it with: tutor images build openedx-dev"
+    )
+venv = eval(args["manifest_expression"])
+
+
+def modified_files(name):
+    for d in importlib.metadata.distributions():
+        if d.metadata["Name"] and eval(args["distribution_name"]) == name:
+            break
+    for file in d.files or []:
+        if not file.hash:
+            continue
+        try:
+            with open(file.locate(), "rb") as f:
+                digest = hashlib.new(file.hash.mode, f.read()).digest()
+        except FileNotFoundError:
+            return True
+        if base64.urlsafe_b64encode(digest).rstrip(b"=").decode() != file.hash.value:
+            return True
+    return False
+
+
+def requirement(name):
+    version, _record_hash, direct_url, location = image[name]
+    if direct_url:
+        direct_url = json.loads(direct_url)
+        if "vcs_info" in direct_url:
+            vcs_info = direct_url["vcs_info"]
+            return [
+                f"{vcs_info['vcs']}+{direct_url['url']}@{vcs_info['commit_id']}"
+                f"#egg={name}"
+            ]
+        if direct_url.get("dir_info", {}).get("editable"):
+            return ["-e", direct_url["url"].replace("file://", "", 1)]
+        return [direct_url["url"]]
+    if not location.startswith(sys.prefix + os.sep):
+        # Installed with `setup.py develop`, such as edx-platform itself.
+        return ["-e", location]
+    return [f"{name}=={version}"]
+
+
+def mounted_package(name):
+    """
+    The mounted package which a distribution in the venv was installed from, as
+    keyed in the ledger: either in editable mode, or as a wheel from the wheelhouse.
+    """
+    _version, _record_hash, direct_url, location = venv[name]
+    if direct_url:
+        path = urllib.parse.unquote(
+            urllib.parse.urlparse(json.loads(direct_url)["url"]).path
+        )
+    else:
+        path = location
+    for parent in (MOUNTS, WHEELHOUSE):
+        if path.startswith(parent + "/"):
+            return os.path.join(MOUNTS, path[len(parent) + 1 :].split("/")[0])
+    return None
+
+
+def forget_mounted_packages(names):
+    """
+    Drop the ledger entries of the packages which the given distributions were
+    installed from. This happens before pip runs, since a missing entry only
+    costs an extra reinstall, whereas a stale one would skip a needed one.
+    """
+    packages = {mounted_package(name) for name in names if name in venv} - {None}
+    if not packages or not os.path.exists(LEDGER):
+        return []
+    with open(LEDGER) as f:
+        lines = f.readlines()
+    with open(LEDGER, "w") as f:
+        f.writelines(line for line in lines if line.split(" ", 1)[0] not in packages)
+    return sorted(packages)
+
+
+to_uninstall = sorted(venv.keys() - image.keys())
+to_reinstall = {}
+for name, (version, record_hash, _direct_url, _location) in sorted(image.items()):
+    if name not in venv:
+        to_reinstall[name] = "missing"
+    elif venv[name][0] != version:
+        to_reinstall[name] = f"{venv[name][0]} -> {version}"
+    elif venv[name][1:] != [record_hash, *image[name][2:]]:
+        to_reinstall[name] = "reinstalled differently"
+    elif args["check_files"] and modified_files(name):
+        to_reinstall[name] = "modified files"
+
+forgotten = forget_mounted_packages([*to_uninstall, *to_reinstall])
+if to_uninstall:
+    subprocess.check_call(["pip", "uninstall", "--yes", *to_uninstall])
+if to_reinstall:
+    subprocess.check_call(
+        [
+            "pip",
+            "install",
+            "--no-deps",
+            "--force-reinstall",
+            *(arg for name in to_reinstall for arg in requirement(name)),
+        ]
+    )
+for name in to_uninstall:
+    print(f"Uninstalled {name} {venv[name][0]} (not in the image)")
+for name, reason in to_reinstall.items():
+    print(f"Reinstalled {name} {image[name][0]} ({reason})")
+for package in forgotten:
+    print(f"Forgot that {package} was installed; pip-install-mounts will reinstall it")
+print(
+    f"{len(image) - len(to_reinstall)} of {len(image)} distributions "
+    "already matched the image."
+)
@@ -0,0 +1,201 @@
+# Run by `tutor dev do watch-mounts`.
+# Takes a JSON argument of {"debounce": seconds, "ledger": path,
+# "metadata_globs": [glob], "metadata_hash_command": str, "pipelines": {name: pipeline}}.
+#
+# Watches every directory of every mounted package with inotify (through ctypes, so
+# that the image doesn't need inotify-tools), adding watches for new directories as
+# they appear. Once changes have settled, for each changed package: if a metadata
+# file changed and the package's metadata hash differs from the one in the ledger,
+# then it's reinstalled, all in one pip command. Then, the asset pipelines which
+# read mounted packages' files of the changed types are re-run, along with their
+# downstream steps. Failures are reported, and watching continues.
+#
+# Pipelines which are run here don't update the fingerprints of build_static.py,
+# since the inputs of a pipeline include edx-platform files which aren't watched.
+# So, the next `pip-install-mounts --build-static` may re-run them once more.
+import ctypes, fnmatch, json, os, select, struct, subprocess, sys, time
+
+args = json.loads(sys.argv[1])
+LEDGER = args["ledger"]
+METADATA_GLOBS = args["metadata_globs"]
+METADATA_HASH_COMMAND = args["metadata_hash_command"]
+PIPELINES = args["pipelines"]
+MOUNTS = "/openedx/mounted-packages"
+EDX_PLATFORM = "/openedx/edx-platform"
+IGNORED_DIRS = {".git", "__pycache__", "node_modules", "build", "dist", ".tox"}
+IGNORED_SUFFIXES = (".egg-info", ".pyc", ".swp", ".swx", "~")
+
+IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x2, 0x8, 0x40, 0x80
+IN_CREATE, IN_DELETE, IN_Q_OVERFLOW, IN_ISDIR = 0x100, 0x200, 0x4000, 0x40000000
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+libc = ctypes.CDLL(None, use_errno=True)
+inotify_fd = libc.inotify_init1(os.O_CLOEXEC)
+if inotify_fd < 0:
+    sys.exit("Could not initialize inotify: " + os.strerror(ctypes.get_errno()))
+watched_dirs = {}  # type: dict[int, str]
+
+
+def ignored(path):
+    return any(
+        part in IGNORED_DIRS or part.endswith(IGNORED_SUFFIXES)
+        for part in os.path.relpath(path, MOUNTS).split(os.sep)
+    )
+
+
+def watch(root):
+    """Watch a directory tree, and return the files already in it."""
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [
+            name for name in dirnames if not ignored(os.path.join(dirpath, name))
+        ]
+        wd = libc.inotify_add_watch(inotify_fd, dirpath.encode(), WATCH_MASK)
+        if wd < 0:
+            print(
+                f"Could not watch {dirpath}: {os.strerror(ctypes.get_errno())}",
+                file=sys.stderr,
+            )
+            continue
+        watched_dirs[wd] = dirpath
+        files += [os.path.join(dirpath, name) for name in filenames]
+    return files
+
+
+def read_changes():
+    changed = set()
+    data = os.read(inotify_fd, 1024 * 1024)
+    offset = 0
+    while offset < len(data):
+        wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+        name = data[offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length]
+        offset += EVENT_HEADER.size + length
+        if mask & IN_Q_OVERFLOW:
+            print(
+                "Too many changes to keep track of; treating everything as changed.",
+                file=sys.stderr,
+            )
+            for package in packages:
+                changed.update(os.path.join(package, glob) for glob in METADATA_GLOBS)
+                for root, _dirs, filenames in os.walk(package):
+                    changed.update(
+                        os.path.join(root, filename) for filename in filenames
+                    )
+            continue
+        if wd not in watched_dirs:
+            continue
+        path = os.path.join(watched_dirs[wd], name.rstrip(b"\0").decode())
+        if ignored(path):
+            continue
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may have been created before the directory was watched.
+                changed.update(watch(path))
+        else:
+            changed.add(path)
+    return changed
+
+
+def metadata_hash(package):
+    return (
+        subprocess.check_output(["sh", "-c", METADATA_HASH_COMMAND], cwd=package)
+        .decode()
+        .strip()
+    )
+
+
+def read_ledger():
+    if not os.path.exists(LEDGER):
+        return {}
+    with open(LEDGER) as f:
+        return dict(line.rstrip("\n").split(" ", 1) for line in f if " " in line)
+
+
+def rebuild(changed):
+    start = time.monotonic()
+    changed_by_package = {}
+    for path in changed:
+        package = os.path.join(MOUNTS, os.path.relpath(path, MOUNTS).split(os.sep)[0])
+        changed_by_package.setdefault(package, set()).add(
+            os.path.relpath(path, package)
+        )
+    ledger = read_ledger()
+    to_install = {}
+    pipelines = set()
+    for package, paths in sorted(changed_by_package.items()):
+        print(f"{len(paths)} file(s) changed in {package}.", file=sys.stderr)
+        if any(
+            fnmatch.fnmatch(path, glob) for path in paths for glob in METADATA_GLOBS
+        ):
+            package_hash = metadata_hash(package)
+            if ledger.get(package) != package_hash:
+                to_install[package] = package_hash
+        for name, pipeline in PIPELINES.items():
+            extensions = tuple(pipeline.get("extensions", []))
+            if (
+                "MOUNTED_PACKAGES" in pipeline["dirs"]
+                and extensions
+                and any(path.endswith(extensions) for path in paths)
+            ):
+                pipelines.add(name)
+                pipelines.update(pipeline["downstream"])
+    if to_install:
+        print("Reinstalling: " + " ".join(to_install), file=sys.stderr)
+        pip_args = [arg for package in to_install for arg in ("-e", package)]
+        if subprocess.call(["pip", "install", *pip_args]) == 0:
+            # Re-read the ledger, in case pip-install-mounts ran in the meantime.
+            ledger = read_ledger()
+            ledger.update(to_install)
+            with open(LEDGER, "w") as f:
+                f.writelines(
+                    package + " " + value + "\n" for package, value in ledger.items()
+                )
+        else:
+            print(
+                "Reinstallation failed; will retry on the next change.", file=sys.stderr
+            )
+    for name, pipeline in PIPELINES.items():
+        if name in pipelines:
+            print(
+                "Running asset pipeline: " + " ".join(pipeline["command"]),
+                file=sys.stderr,
+            )
+            if subprocess.call(pipeline["command"], cwd=EDX_PLATFORM) != 0:
+                print(f"Asset pipeline {name} failed.", file=sys.stderr)
+                break
+    if to_install or pipelines:
+        print(f"Rebuilt in {time.monotonic() - start:.1f}s.", file=sys.stderr)
+    else:
+        print("Nothing to rebuild.", file=sys.stderr)
+
+
+debounce = args["debounce"]
+packages = (
+    sorted(os.path.join(MOUNTS, name) for name in os.listdir(MOUNTS))
+    if os.path.isdir(MOUNTS)
+    else []
+)
+if not packages:
+    sys.exit("Directory /openedx/mounted-packages is empty; nothing to watch.")
+for package in packages:
+    watch(package)
+print(
+    f"Watching {len(packages)} mounted package(s) for changes. Press Ctrl+C to stop.",
+    file=sys.stderr,
+)
+
+changed = set()  # type: set[str]
+try:
+    while True:
+        # Block until the first change, then wait until changes have settled.
+        ready, _, _ = select.select([inotify_fd], [], [], debounce if changed else None)
+        if ready:
+            changed |= read_changes()
+        elif changed:
+            rebuild(changed)
+            changed = set()
+except KeyboardInterrupt:
+    pass
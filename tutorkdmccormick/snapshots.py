@@ -0,0 +1,529 @@
+"""
+The `tutor quickdev snapshot`, `restore`, and `clone-volumes` commands, which
+save, restore, and copy the contents of the named volumes in volumes.py.
+
+This isn't a plugin itself; the quickdev plugin adds these commands. Each volume
+is streamed as a tar archive through the Docker API, via a throwaway container
+which mounts the volume but is never started.
+For snapshots, the contents of each file are split into chunks, which are compressed
+(with zstd if the 'zstandard' package is installed, or else zlib) and stored under
+their SHA-256 hash, so that a chunk shared between files, volumes, or snapshots is
+stored only once. A snapshot itself is a gzipped JSON manifest listing each volume's
+tar headers, plus the chunks of each file.
+
+The quickdev plugin imports this module on every `tutor` invocation, so the
+archive and compression modules are only imported once they're needed.
+"""
+from __future__ import annotations
+
+import contextlib
+import io
+import json
+import os
+import re
+import time
+import typing as t
+
+import click
+
+from . import tracing, volumes
+from .dockerapi import DockerClient
+
+if t.TYPE_CHECKING:
+    import tarfile
+
+CHUNK_SIZE = 1024 * 1024
+
+# Where volumes are mounted within the throwaway containers.
+MOUNT_POINT = "/quickdev-volume"
+
+# The tar header fields which we save & restore.
+TARINFO_FIELDS = (
+    "name",
+    "mode",
+    "uid",
+    "gid",
+    "size",
+    "mtime",
+    "linkname",
+    "uname",
+    "gname",
+    "devmajor",
+    "devminor",
+)
+
+
+@click.command()
+@click.option(
+    "-v",
+    "--volume",
+    "volume_names",
+    multiple=True,
+    type=click.Choice(list(volumes.ALL_NAMED_VOLUMES)),
+    help=(
+        "Only snapshot this volume (may be repeated). By default, all Python, "
+        "NPM, and static asset volumes are snapshotted"
+    ),
+)
+@click.argument("name")
+@click.pass_obj
+def snapshot(context: t.Any, name: str, volume_names: tuple[str, ...]) -> None:
+    """
+    Save the contents of named volumes to the host, to be restored later.
+    """
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    config = volumes.load_config(context.root)
+    store = _SnapshotStore(context.root)
+    store.check_name(name)
+    client = DockerClient()
+    volume_names = volume_names or tuple(volumes.named_volumes(config))
+    with ThreadPoolExecutor() as executor:
+        results = list(
+            executor.map(
+                lambda volume_name: _snapshot_volume(
+                    client,
+                    config["DOCKER_IMAGE_OPENEDX_DEV"],
+                    store,
+                    volumes.docker_volume_name(config, volume_name),
+                ),
+                volume_names,
+            )
+        )
+    contents = {}
+    for volume_name, result in zip(volume_names, results):
+        if result is None:
+            click.echo(
+                f"Skipped {volume_name}, which has not been created yet "
+                "(so it still has the image's contents)."
+            )
+            continue
+        entries, total_bytes, new_bytes = result
+        contents[volume_name] = entries
+        click.echo(
+            f"Saved {volume_name}: {len(entries)} entries, "
+            f"{total_bytes / 1024 / 1024:.1f} MB "
+            f"({new_bytes / 1024 / 1024:.1f} MB of new compressed chunks)."
+        )
+    store.save_manifest(
+        name,
+        {
+            "generation": volumes.image_generation(config["DOCKER_IMAGE_OPENEDX_DEV"]),
+            "created": time.time(),
+            "volumes": contents,
+        },
+    )
+    click.echo(f"Saved snapshot '{name}'.")
+
+
+@click.command()
+@click.option(
+    "-v",
+    "--volume",
+    "volume_names",
+    multiple=True,
+    type=click.Choice(list(volumes.ALL_NAMED_VOLUMES)),
+    help=(
+        "Only restore this volume (may be repeated). By default, all volumes "
+        "in the snapshot are restored"
+    ),
+)
+@click.argument("name")
+@click.pass_obj
+def restore(context: t.Any, name: str, volume_names: tuple[str, ...]) -> None:
+    """
+    Replace the contents of named volumes with those of a snapshot.
+    """
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    config = volumes.load_config(context.root)
+    store = _SnapshotStore(context.root)
+    manifest = store.load_manifest(name)
+    for volume_name in volume_names:
+        if volume_name not in manifest["volumes"]:
+            raise click.ClickException(
+                f"Snapshot '{name}' does not include {volume_name}."
+            )
+    volume_names = volume_names or tuple(manifest["volumes"])
+    current = volumes.image_generation(config["DOCKER_IMAGE_OPENEDX_DEV"])
+    if manifest["generation"] != current:
+        click.echo(
+            f"Warning: snapshot '{name}' was taken with a different openedx-dev "
+            "image than the current one.",
+            err=True,
+        )
+    volumes.delete_volumes(config, volume_names)
+    client = DockerClient()
+    with ThreadPoolExecutor() as executor:
+        list(
+            executor.map(
+                lambda volume_name: _restore_volume(
+                    client,
+                    config["DOCKER_IMAGE_OPENEDX_DEV"],
+                    store,
+                    volumes.docker_volume_name(config, volume_name),
+                    manifest["volumes"][volume_name],
+                ),
+                volume_names,
+            )
+        )
+    for volume_name in volume_names:
+        click.echo(f"Restored {volume_name}.")
+
+
+@click.command()
+@click.option(
+    "--from",
+    "source_project",
+    required=True,
+    help="Name of the Compose project to copy volumes from, such as 'tutor_dev'",
+)
+@click.option(
+    "-v",
+    "--volume",
+    "volume_names",
+    multiple=True,
+    type=click.Choice(list(volumes.ALL_NAMED_VOLUMES)),
+    help=(
+        "Only clone this volume (may be repeated). By default, all Python, "
+        "NPM, and static asset volumes are cloned"
+    ),
+)
+@click.option(
+    "-f",
+    "--force",
+    is_flag=True,
+    help="Replace volumes which already exist in this project",
+)
+@click.pass_obj
+def clone_volumes(
+    context: t.Any, source_project: str, volume_names: tuple[str, ...], force: bool
+) -> None:
+    """
+    Copy named volumes from another project, such as Stable's into Nightly's.
+
+    Only volumes which were populated from the same openedx-dev image as this
+    project's are copied.
+    """
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    config = volumes.load_config(context.root)
+    if source_project == config["DEV_PROJECT_NAME"]:
+        raise click.ClickException("Cannot clone volumes from the current project.")
+    if not config["QUICKDEV_IMAGE_GENERATIONS"]:
+        raise click.ClickException(
+            "Cloning volumes requires QUICKDEV_IMAGE_GENERATIONS, which is how we "
+            "know which image a volume was populated from."
+        )
+    if not volumes.image_generation(config["DOCKER_IMAGE_OPENEDX_DEV"]):
+        raise click.ClickException(
+            f"Image {config['DOCKER_IMAGE_OPENEDX_DEV']} is not available locally."
+        )
+    source_config = {**config, "DEV_PROJECT_NAME": source_project}
+    client = DockerClient()
+    to_clone = []
+    for volume_name in volume_names or volumes.named_volumes(config):
+        source = volumes.docker_volume_name(source_config, volume_name)
+        target = volumes.docker_volume_name(config, volume_name)
+        if not client.volume_exists(source):
+            click.echo(
+                f"Skipped {volume_name}: {source_project} has no copy of it "
+                "populated from the current image."
+            )
+        elif client.volume_exists(target) and not force:
+            click.echo(
+                f"Skipped {volume_name}, which already exists "
+                "(use -f/--force to replace it)."
+            )
+        else:
+            to_clone.append(volume_name)
+    if not to_clone:
+        return
+    volumes.delete_volumes(config, to_clone)
+    with ThreadPoolExecutor() as executor:
+        list(
+            executor.map(
+                lambda volume_name: _clone_volume(
+                    client,
+                    config["DOCKER_IMAGE_OPENEDX_DEV"],
+                    volumes.docker_volume_name(source_config, volume_name),
+                    volumes.docker_volume_name(config, volume_name),
+                ),
+                to_clone,
+            )
+        )
+    for volume_name in to_clone:
+        click.echo(f"Cloned {volume_name} from {source_project}.")
+
+
+class _SnapshotStore:
+    """
+    Snapshot manifests & compressed chunks, stored in the project's data directory.
+    """
+
+    def __init__(self, root: str):
+        # pylint: disable=import-outside-toplevel
+        from tutor import env as tutor_env
+
+        self.path = tutor_env.data_path(root, "quickdev", "snapshots")
+        try:
+            import zstandard  # type: ignore
+        except ImportError:  # Snapshots fall back to zlib compression.
+            zstandard = None
+        self.zstandard = zstandard
+
+    def check_name(self, name: str) -> None:
+        """
+        Raise an error unless a snapshot name is safe to use as a file name.
+        """
+        if not re.fullmatch(r"[\w][\w.-]*", name):
+            raise click.ClickException(
+                f"Invalid snapshot name '{name}'. Use letters, numbers, '.', '_' and '-'."
+            )
+
+    def names(self) -> list[str]:
+        """
+        List the names of the saved snapshots, alphabetically.
+        """
+        try:
+            filenames = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            filename[: -len(".json.gz")]
+            for filename in filenames
+            if filename.endswith(".json.gz")
+        )
+
+    def save_manifest(self, name: str, manifest: dict[str, t.Any]) -> None:
+        """
+        Save a snapshot's manifest, replacing any snapshot of the same name.
+        """
+        import gzip  # pylint: disable=import-outside-toplevel
+
+        path = os.path.join(self.path, f"{name}.json.gz")
+        os.makedirs(self.path, exist_ok=True)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(path + ".tmp", path)
+
+    def load_manifest(self, name: str) -> dict[str, t.Any]:
+        """
+        Load a snapshot's manifest, or raise an error listing the available ones.
+        """
+        import gzip  # pylint: disable=import-outside-toplevel
+
+        self.check_name(name)
+        try:
+            with gzip.open(
+                os.path.join(self.path, f"{name}.json.gz"), "rt", encoding="utf-8"
+            ) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError as exc:
+            raise click.ClickException(
+                f"There is no snapshot named '{name}'. Available snapshots: "
+                + (", ".join(self.names()) or "(none)")
+            ) from exc
+
+    def _chunk_path(self, digest: str, extension: str) -> str:
+        return os.path.join(self.path, "chunks", digest[:2], digest + extension)
+
+    def add_chunk(self, data: bytes) -> tuple[str, int]:
+        """
+        Store a chunk, unless it's already stored.
+
+        Returns the chunk's hash and the number of bytes newly written to disk.
+        """
+        # pylint: disable=import-outside-toplevel
+        import hashlib
+        import zlib
+
+        digest = hashlib.sha256(data).hexdigest()
+        for extension in (".zst", ".zz"):
+            if os.path.exists(self._chunk_path(digest, extension)):
+                return digest, 0
+        if self.zstandard is not None:
+            path = self._chunk_path(digest, ".zst")
+            compressed = self.zstandard.ZstdCompressor().compress(data)
+        else:
+            path = self._chunk_path(digest, ".zz")
+            compressed = zlib.compress(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a unique temporary file, in case another thread is storing an
+        # identical chunk at the same time.
+        tmp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with open(tmp_path, "wb") as chunk_file:
+            chunk_file.write(compressed)
+        os.replace(tmp_path, path)
+        return digest, len(compressed)
+
+    def get_chunk(self, digest: str) -> bytes:
+        """
+        Load and decompress a stored chunk.
+        """
+        import zlib  # pylint: disable=import-outside-toplevel
+
+        path = self._chunk_path(digest, ".zz")
+        if os.path.exists(path):
+            with open(path, "rb") as chunk_file:
+                return zlib.decompress(chunk_file.read())
+        if self.zstandard is None:
+            raise click.ClickException(
+                "This snapshot was compressed with zstd. To restore it, "
+                "install the 'zstandard' Python package."
+            )
+        with open(self._chunk_path(digest, ".zst"), "rb") as chunk_file:
+            return self.zstandard.ZstdDecompressor().decompress(chunk_file.read())
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    A file-like view of a file's contents, decompressed chunk by chunk.
+    """
+
+    def __init__(self, store: _SnapshotStore, digests: list[str]):
+        super().__init__()
+        self._chunks = (store.get_chunk(digest) for digest in digests)
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: t.Any) -> int:
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = chunk
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+@contextlib.contextmanager
+def _volume_container(
+    client: DockerClient, image: str, docker_volume_name: str
+) -> t.Iterator[str]:
+    """
+    Create a throwaway container, which is never started, with a volume mounted
+    at MOUNT_POINT.
+
+    Since nothing exists at that path in the image, a volume which doesn't exist yet
+    is created empty rather than being populated from the image.
+    """
+    with tracing.span("volume container", volume=docker_volume_name):
+        container_id = client.create_container(
+            image, [f"{docker_volume_name}:{MOUNT_POINT}"]
+        )
+        try:
+            yield container_id
+        finally:
+            client.remove_container(container_id)
+
+
+def _snapshot_volume(
+    client: DockerClient, image: str, store: _SnapshotStore, docker_volume_name: str
+) -> t.Optional[tuple[list[dict[str, t.Any]], int, int]]:
+    """
+    Stream the contents of a volume into the snapshot store.
+
+    Returns the volume's tar entries, its total size, and the number of bytes newly
+    written to the store; or None if the volume doesn't exist.
+    """
+    import tarfile  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    # Mounting a volume which doesn't exist would create it empty, which would
+    # prevent it from being populated from the image later.
+    if not client.volume_exists(docker_volume_name):
+        return None
+    entries = []
+    total_bytes = new_bytes = 0
+    with _volume_container(client, image, docker_volume_name) as container_id:
+        with client.get_archive(container_id, MOUNT_POINT) as archive:
+            with tarfile.open(fileobj=archive, mode="r|") as tar:
+                for member in tar:
+                    entry, size, written = _snapshot_member(store, tar, member)
+                    entries.append(entry)
+                    total_bytes += size
+                    new_bytes += written
+    return entries, total_bytes, new_bytes
+
+
+def _snapshot_member(
+    store: _SnapshotStore, tar: tarfile.TarFile, member: tarfile.TarInfo
+) -> tuple[dict[str, t.Any], int, int]:
+    """
+    Store the contents of one tar entry (if it's a file) as chunks.
+
+    Returns the entry for the manifest, the size of the file, and the number of
+    bytes newly written to the store.
+    """
+    entry = {field: getattr(member, field) for field in TARINFO_FIELDS}
+    entry["type"] = member.type.decode("ascii")
+    entry["chunks"] = []
+    size = new_bytes = 0
+    contents = tar.extractfile(member) if member.isfile() else None
+    while contents:
+        chunk = contents.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest, written = store.add_chunk(chunk)
+        entry["chunks"].append(digest)
+        size += len(chunk)
+        new_bytes += written
+    return entry, size, new_bytes
+
+
+def _restore_volume(
+    client: DockerClient,
+    image: str,
+    store: _SnapshotStore,
+    docker_volume_name: str,
+    entries: list[dict[str, t.Any]],
+) -> None:
+    """
+    Create a volume, and stream a snapshot of its contents into it.
+    """
+    with _volume_container(client, image, docker_volume_name) as container_id:
+        client.put_archive_from(
+            container_id,
+            "/",
+            lambda tar: _write_snapshot_archive(store, entries, tar),
+        )
+
+
+def _write_snapshot_archive(
+    store: _SnapshotStore, entries: list[dict[str, t.Any]], tar: tarfile.TarFile
+) -> None:
+    import tarfile  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    for entry in entries:
+        info = tarfile.TarInfo()
+        for field in TARINFO_FIELDS:
+            setattr(info, field, entry[field])
+        info.type = entry["type"].encode("ascii")
+        tar.addfile(
+            info,
+            io.BufferedReader(_ChunkReader(store, entry["chunks"]))
+            if info.isfile()
+            else None,
+        )
+
+
+def _clone_volume(
+    client: DockerClient, image: str, source_volume_name: str, target_volume_name: str
+) -> None:
+    """
+    Create a volume, and stream the contents of another volume into it.
+    """
+    with _volume_container(
+        client, image, source_volume_name
+    ) as source_container_id, _volume_container(
+        client, image, target_volume_name
+    ) as target_container_id:
+        with client.get_archive(source_container_id, MOUNT_POINT) as archive:
+            client.put_archive(target_container_id, "/", archive)
@@ -3,20 +3,34 @@ A Tutor plugin to automatically stop Nightly containers when starting
 Stable containers, and vice versa.
 
 Implementation is currently hacky.
+
+Importing this module must stay cheap, since it happens on every `tutor`
+invocation. So, everything beyond the plugin API is imported when the
+hook actually runs.
 """
 from __future__ import annotations
 
+import json
+import os
+import typing as t
+
+import click
 from tutor import hooks
 
 # isort:skip
-# HACK: None of these modules are part of the official plugin API.
-from tutor import config as tutor_config
+# HACK: Not part of the official plugin API.
 from tutor.__about__ import __app__ as tutor_current_app
-from tutor.commands.dev import DevTaskRunner
-from tutor.commands.local import LocalTaskRunner
+
+from . import tracing
+
+# By default, all of the other app's containers are stopped. With this setting,
+# only those whose host ports or container names collide with the project
+# being started are stopped, so that services like MySQL and Mongo stay warm.
+hooks.Filters.CONFIG_DEFAULTS.add_item(("STOPNIGHTLY_ONLY_CONFLICTS", False))
 
 
 @hooks.Actions.COMPOSE_PROJECT_STARTED.add()
+@tracing.traced
 def _stop_other_projects(root: str, config: dict, project_name: str) -> None:
     """
     When Tutor Stable is started, stop Nightly (both dev and local modes).
@@ -25,15 +39,186 @@ def _stop_other_projects(root: str, config: dict, project_name: str) -> None:
     Tutor Stable already takes care of stopping dev mode when local is started,
     and vice versa. Same thing for Tutor Nightly. It's just across Stable<->Nightly
     that doesn't get automatically stopped without this function.
+
+    Only the projects which actually have running containers are stopped, in
+    parallel. Usually, nothing needs to be stopped, so we check that first, which
+    only takes a single Docker API call: unless some other compose project is
+    running, the other app's config isn't even loaded. With
+    STOPNIGHTLY_ONLY_CONFLICTS, only the conflicting containers are stopped.
     """
-    # Ignore the provided config and project, because it's not what we want
-    # to stop.
-    _ = config
-    _ = project_name
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    # HACK: None of these modules are part of the official plugin API.
+    from tutor.commands.dev import DevTaskRunner
+    from tutor.commands.local import LocalTaskRunner
+
+    from .dockerapi import DockerApiError, DockerClient
 
     app_to_stop = "tutor" if tutor_current_app == "tutor-nightly" else "tutor-nightly"
     app_to_stop = app_to_stop.replace("-", "_")
 
+    try:
+        containers: t.Optional[list[dict]] = [
+            container
+            for container in DockerClient().running_compose_containers()
+            if container["Labels"]["com.docker.compose.project"]
+            not in (config["LOCAL_PROJECT_NAME"], config["DEV_PROJECT_NAME"])
+        ]
+    except (OSError, DockerApiError):
+        # We can't tell what's running, so fall back to just trying to stop
+        # the other app's projects.
+        containers = None
+    if containers == []:
+        return
+
+    config_to_stop = _load_config_to_stop(root, app_to_stop)
+    runner_classes_by_project = {
+        config_to_stop["LOCAL_PROJECT_NAME"]: LocalTaskRunner,
+        config_to_stop["DEV_PROJECT_NAME"]: DevTaskRunner,
+    }
+    if containers is not None:
+        containers = [
+            container
+            for container in containers
+            if container["Labels"]["com.docker.compose.project"]
+            in runner_classes_by_project
+        ]
+
+    if containers is not None and config["STOPNIGHTLY_ONLY_CONFLICTS"]:
+        _stop_conflicting_containers(root, config, project_name, containers)
+        return
+
+    runner_classes = [
+        runner_class
+        for other_project_name, runner_class in runner_classes_by_project.items()
+        if containers is None
+        or any(
+            container["Labels"]["com.docker.compose.project"] == other_project_name
+            for container in containers
+        )
+    ]
+
+    def stop_project(runner_class: type) -> None:
+        runner = runner_class(root, config_to_stop)
+        with tracing.span(
+            "docker compose stop", "subprocess", project=runner.project_name
+        ):
+            runner.docker_compose("stop")
+
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(stop_project, runner_classes))
+
+
+def _stop_conflicting_containers(
+    root: str, config: dict, project_name: str, containers: list[dict]
+) -> None:
+    """
+    Stop only those of the other app's running containers which would collide with
+    the project being started, either by publishing the same host port or by
+    having the same container name.
+    """
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .dockerapi import DockerClient
+
+    ports, container_names = _compose_ports_and_container_names(
+        root, config, project_name
+    )
+    conflicting = []
+    for container in containers:
+        reasons = [
+            f"port {port['PublicPort']}"
+            for port in container.get("Ports") or []
+            if port.get("PublicPort") in ports
+        ] + [
+            f"name {name.lstrip('/')}"
+            for name in container.get("Names") or []
+            if name.lstrip("/") in container_names
+        ]
+        if reasons:
+            click.echo(
+                f"Stopping {container['Labels']['com.docker.compose.project']}/"
+                f"{container['Labels'].get('com.docker.compose.service', '?')}, "
+                f"which conflicts with {project_name} ({', '.join(reasons)})"
+            )
+            conflicting.append(container["Id"])
+    client = DockerClient()
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(client.stop_container, conflicting))
+
+
+def _compose_ports_and_container_names(
+    root: str, config: dict, project_name: str
+) -> tuple[set[int], set[str]]:
+    """
+    Collect the host ports published, and the container names set, by any
+    service in the compose files of the project being started.
+    """
+    # pylint: disable=import-outside-toplevel
+    from tutor import serialize
+    from tutor.commands.dev import DevTaskRunner
+    from tutor.commands.local import LocalTaskRunner
+
+    runner_class = (
+        DevTaskRunner if project_name == config["DEV_PROJECT_NAME"] else LocalTaskRunner
+    )
+    ports: set[int] = set()
+    container_names: set[str] = set()
+    for compose_file_path in runner_class(root, config).docker_compose_files:
+        if not os.path.exists(compose_file_path):
+            continue
+        with open(compose_file_path, encoding="utf-8") as compose_file:
+            compose = serialize.load(compose_file) or {}
+        for service in (compose.get("services") or {}).values():
+            service = service or {}
+            if service.get("container_name"):
+                container_names.add(service["container_name"])
+            for port in service.get("ports") or []:
+                ports.update(_published_ports(port))
+    return ports, container_names
+
+
+def _published_ports(port: t.Union[str, int, dict]) -> range:
+    """
+    Parse the host port(s) of an entry in a compose service's `ports` list.
+
+    Entries are either dicts (long syntax) or strings like
+    "[HOST_IP:][HOST_PORT:]CONTAINER_PORT[/PROTOCOL]", where ports may be ranges.
+    """
+    if isinstance(port, dict):
+        published = str(port.get("published") or "")
+    else:
+        parts = str(port).split("/", maxsplit=1)[0].rsplit(":", 2)
+        published = parts[-2] if len(parts) > 1 else ""
+    if not published:
+        return range(0)
+    first, _, last = published.partition("-")
+    return range(int(first), int(last or first) + 1)
+
+
+def _load_config_to_stop(root: str, app_to_stop: str) -> dict:
+    """
+    Load the config of the other app, as if it were loaded by the other app.
+
+    Loading the config is slow, so the result is cached on disk, keyed by the
+    modification time of config.yml.
+    """
+    # pylint: disable=import-outside-toplevel
+    from tutor import config as tutor_config
+    from tutor import env as tutor_env
+
+    cache_path = tutor_env.data_path(root, "stopnightly", f"{app_to_stop}.json")
+    config_mtime = os.stat(tutor_config.config_path(root)).st_mtime_ns
+    try:
+        with open(cache_path, encoding="utf-8") as cache_file:
+            cached = json.load(cache_file)
+        if cached["config_mtime"] == config_mtime:
+            return cached["config"]
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
     with hooks.contexts.enter("stop-other-projects"):
 
         @hooks.Filters.ENV_TEMPLATE_VARIABLES.add()
@@ -43,8 +228,11 @@ def _stop_other_projects(root: str, config: dict, project_name: str) -> None:
             ]
             return template_vars_without_tutor_app + [("TUTOR_APP", app_to_stop)]
 
-    config_to_stop = tutor_config.load(root)
+    with tracing.span("load config", app=app_to_stop):
+        config_to_stop = tutor_config.load(root)
     hooks.clear_all(context="stop-other-projects")
 
-    LocalTaskRunner(root, config_to_stop).docker_compose("stop")
-    DevTaskRunner(root, config_to_stop).docker_compose("stop")
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "w", encoding="utf-8") as cache_file:
+        json.dump({"config_mtime": config_mtime, "config": config_to_stop}, cache_file)
+    return config_to_stop
@@ -0,0 +1,175 @@
+"""
+Optional tracing for the plugins in this package, to find out where the time goes
+during slow `tutor` commands such as `tutor dev start`.
+
+This isn't a plugin itself. Set $TUTORKDMCCORMICK_TRACE to a file path, and each
+hook callback, subprocess, Docker API request, and notable step run by our plugins
+is recorded in that file, along with its arguments, result, and wall time. The file
+is in the JSON array flavor of the Chrome trace event format; open it with
+https://ui.perfetto.dev or chrome://tracing. Each process appends its events to the
+file when it exits, so the events of nested `tutor` commands (and of subsequent
+ones) end up in the same trace. Delete the file to start afresh.
+
+When the variable is unset, tracing costs next to nothing: `traced` returns
+functions unchanged, and `span` records nothing.
+"""
+from __future__ import annotations
+
+import atexit
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+import typing as t
+
+if t.TYPE_CHECKING:
+    import subprocess
+
+TRACE_PATH = os.environ.get("TUTORKDMCCORMICK_TRACE", "")
+
+# Subprocess arguments longer than this (such as inline scripts) are truncated.
+MAX_ARG_LENGTH = 200
+
+FuncT = t.TypeVar("FuncT", bound=t.Callable[..., t.Any])
+
+_events: list[dict[str, t.Any]] = []
+_events_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def span(
+    name: str, category: str = "step", **args: t.Any
+) -> t.Iterator[dict[str, t.Any]]:
+    """
+    Record the wall time of a block of code, along with some arguments.
+
+    Yields the arguments, so that the block can add its results to them. If the
+    block raises an exception, then that is recorded too.
+    """
+    if not TRACE_PATH:
+        yield args
+        return
+    start_us = time.time_ns() // 1000
+    start = time.perf_counter_ns()
+    try:
+        yield args
+    except BaseException as exc:
+        args["error"] = repr(exc)
+        raise
+    finally:
+        _record(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start_us,
+                "dur": (time.perf_counter_ns() - start) // 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+
+def traced(func: FuncT) -> FuncT:
+    """
+    Trace each call of a hook callback.
+
+    Apply this below the hook's decorator, so that the traced function is the one
+    that gets added to the hook.
+    """
+    if not TRACE_PATH:
+        return func
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+        with span(name, "hook"):
+            return func(*args, **kwargs)
+
+    return t.cast(FuncT, wrapper)
+
+
+def run(
+    args: list[str], check: bool = False, **kwargs: t.Any
+) -> subprocess.CompletedProcess:
+    """
+    Like `subprocess.run`, but traced, with the command's exit code.
+    """
+    import subprocess  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    with span(
+        " ".join([os.path.basename(args[0]), *args[1:3]]),
+        "subprocess",
+        argv=[
+            arg if len(arg) <= MAX_ARG_LENGTH else arg[:MAX_ARG_LENGTH] + "..."
+            for arg in args
+        ],
+    ) as span_args:
+        result = subprocess.run(args, check=False, **kwargs)
+        span_args["exit_code"] = result.returncode
+    if check:
+        result.check_returncode()
+    return result
+
+
+def check_call(args: list[str], **kwargs: t.Any) -> int:
+    """
+    Like `subprocess.check_call`, but traced.
+    """
+    return run(args, check=True, **kwargs).returncode
+
+
+def check_output(args: list[str], **kwargs: t.Any) -> bytes:
+    """
+    Like `subprocess.check_output`, but traced.
+    """
+    import subprocess  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    return run(args, check=True, stdout=subprocess.PIPE, **kwargs).stdout
+
+
+def _record(event: dict[str, t.Any]) -> None:
+    with _events_lock:
+        if not _events:
+            atexit.register(_write_events)
+        _events.append(event)
+
+
+def _write_events() -> None:
+    """
+    Append this process's events to the trace file.
+    """
+    # pylint: disable=import-outside-toplevel
+    import json
+
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        fcntl = None  # type: ignore
+
+    with _events_lock:
+        events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "args": {
+                    "name": " ".join([os.path.basename(sys.argv[0]), *sys.argv[1:]])
+                },
+            },
+            *_events,
+        ]
+        _events.clear()
+    with open(TRACE_PATH, "a", encoding="utf-8") as trace_file:
+        # Other processes may be appending to the same file at the same time.
+        if fcntl:
+            fcntl.flock(trace_file, fcntl.LOCK_EX)
+        # The closing bracket of the array is optional, which is what allows
+        # us to keep appending events.
+        if trace_file.seek(0, os.SEEK_END) == 0:
+            trace_file.write("[\n")
+        for event in events:
+            trace_file.write(json.dumps(event, default=str) + ",\n")
@@ -0,0 +1,373 @@
+"""
+The named volumes in which the quickdev plugin keeps requirements and assets, and
+their generations.
+
+This isn't a plugin itself. It's shared by the quickdev plugin's hooks & commands,
+which are spread over quickdev.py, snapshots.py, and bench.py.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import os
+import typing as t
+
+import click
+
+from . import tracing
+from .dockerapi import DockerApiError, DockerClient
+
+# USE NAMED VOLUMES FOR REQUIREMENTS
+#
+# Background:
+# A "named volume" is a type of Docker volume. It's similar to bind-mount
+# volumes, except that we cannot access its contents easily via the host
+# filesystem. The contents are stored in a Docker-internal fashion, and
+# the volume itself is referred by an identifier that we provide in
+# the docker-compose YAML file. They are ideal for situations where
+# containers need to read and write shared data, but the host doesn't
+# need to modify the data. For writing, they outperform the
+# layered container filesystem significantly, and on macOS and Windows
+# they also outperform bind-mounts.
+#
+# Here, we use named volumes for three things:
+# * Python requirements (the virtualenv and the .egg-info file).
+# * NPM requirements (node_modules).
+# * Generated static assets (various edx-platform folders).
+#
+# This helps users because:
+# * Changes to requirements & assets can be persisted and shared between
+#   all lms* and cms* containers, _without_ having to
+#   either rebuild the image (which takes time) or manage
+#   mounted virtual environments (which is cumbersome and confusing).
+# * Writing to any of these volumes is faster than writing either
+#   directly to the container or to the bind-mounted edx-platform
+#   directory.
+#
+# Notes:
+# * These declarations are volume "placeholders".
+#   They are associated with actual named volumes via
+#   Tutor's docker-compose YAML files (which quickdev.py patches).
+#   There, each volume is keyed relative to the compose project, so its actual name
+#   is prefixed with the name of whichever project mounts it.
+# * When a container is started: if the assigned named
+#   volume exists, then it will be used; if not, a new
+#   volume will be created and pre-populated with the original
+#   contents of this directory from the image. This is extremely
+#   useful for us, because it means that the volumes by-default
+#   have the requirements that are built into the dev image!
+# * Yes, the volumes within /openedx/edx-platform/
+#   will point at their named volumes, *even if* a user bind-mounts
+#   their own repository to /openedx/edx-platform! The volumes
+#   just seem to be layered on top of one another so that in
+#   any given folder, the most specific volume "wins".
+# * These are all generated (that is, not git-managed) files,
+#   with the minor exception of /openedx/edx-platform/lms/static/css,
+#   which contains a git-managed 'vendor' folder. While it would be
+#   best to move 'vendor' out of the volume so that edx-platform developers
+#   can modify the folder and see their changes reflected, we are leaving
+#   this as a TODO for now, since that folder hasn't been touched
+#   in 7+ years and doesn't seem like something we should get hung
+#   up on right now.
+PYTHON_REQUIREMENT_VOLUMES: dict[str, str] = {
+    "openedx_venv": "/openedx/venv",
+    "openedx_egg_info": "/openedx/edx-platform/Open_edX.egg-info",
+}
+NODE_REQUIREMENT_VOLUMES: dict[str, str] = {
+    "openedx_node_modules": "/openedx/edx-platform/node_modules",
+}
+STATIC_ASSET_VOLUMES: dict[str, str] = {
+    # Yeah, there are seven different edx-platform directories
+    # for generated static assets. Gross. It's be nice to
+    # work upstream to simplify this.
+    "openedx_common_static_bundles": "/openedx/edx-platform/common/static/bundles",
+    "openedx_common_static_common_css": "/openedx/edx-platform/common/static/common/css",
+    "openedx_common_static_common_js_vendor": (
+        "/openedx/edx-platform/common/static/common/js/vendor"
+    ),
+    "openedx_common_static_xmodule": "/openedx/edx-platform/common/static/xmodule",
+    "openedx_lms_static_certificates_css": "/openedx/edx-platform/lms/static/certificates/css",
+    # note: /openedx/edx-platform/lms/static/css/vendor is git-managed,
+    #       unlike all the other directories here. The folder hasn't changed
+    #       in git in 7+ years, so I'm not too concerned about the
+    #       fact that it's getting sucked into the named volume.
+    "openedx_lms_static_css": "/openedx/edx-platform/lms/static/css",
+    "openedx_cms_static_css": "/openedx/edx-platform/cms/static/css",
+}
+
+# SINGLE ASSET VOLUME
+#
+# Optionally (with QUICKDEV_SINGLE_ASSET_VOLUME), the static assets are instead kept
+# in a single volume, with one sub-directory for each of the STATIC_ASSET_VOLUMES.
+# The image's assets are moved into that directory structure (see DOCKERFILE_PATCH
+# in quickdev.py), so that the volume is populated from the image in one go, and each
+# sub-directory is mounted at its edx-platform path as a volume "subpath". So, there
+# are six fewer volumes to create, populate, check for, and delete.
+#
+# Notes:
+# * Subpath mounts require Docker Engine 26+ and a recent Docker Compose.
+# * Symlinks from the edx-platform paths into the volume would be simpler, but they
+#   would be hidden by a bind-mounted edx-platform repository, whereas volume mounts
+#   are layered on top of it.
+# * A subpath must already exist when the container starts, but Docker only populates
+#   a volume from the image when it's mounted as a whole. So, the volume is created &
+#   populated by populate_single_asset_volume before the services are started, and
+#   only the jobs (which may run first) mount the whole volume as well.
+# * Switching layouts requires rebuilding the openedx-dev image.
+SINGLE_ASSET_VOLUME: dict[str, str] = {
+    "openedx_static_assets": "/openedx/static-assets",
+}
+
+# Every volume which is populated from the image, in either layout.
+ALL_NAMED_VOLUMES: dict[str, str] = {
+    **PYTHON_REQUIREMENT_VOLUMES,
+    **NODE_REQUIREMENT_VOLUMES,
+    **STATIC_ASSET_VOLUMES,
+    **SINGLE_ASSET_VOLUME,
+}
+
+
+def asset_volumes(config: t.Mapping[str, t.Any]) -> dict[str, str]:
+    """
+    Get the volume(s) holding the static assets, in the configured layout.
+    """
+    if config.get("QUICKDEV_SINGLE_ASSET_VOLUME"):
+        return SINGLE_ASSET_VOLUME
+    return STATIC_ASSET_VOLUMES
+
+
+def named_volumes(config: t.Mapping[str, t.Any]) -> dict[str, str]:
+    """
+    Get the volumes which are populated from the image, in the configured layout.
+    """
+    return {
+        **PYTHON_REQUIREMENT_VOLUMES,
+        **NODE_REQUIREMENT_VOLUMES,
+        **asset_volumes(config),
+    }
+
+
+# Download caches for pip and npm (which run as the 'app' user, whose home is /openedx),
+# plus a wheelhouse for mounted packages built with `pip-install-mounts --wheels`.
+# Unlike the volumes above, these are *not* populated from the image, and they are
+# *not* deleted by any of the `*-restore` commands. That way, after reverting to
+# the image's requirements, re-installing them doesn't require re-downloading
+# and re-building everything.
+CACHE_VOLUMES: dict[str, str] = {
+    "openedx_pip_cache": "/openedx/.cache/pip",
+    "openedx_npm_cache": "/openedx/.npm",
+    "openedx_wheelhouse": "/openedx/wheelhouse",
+}
+
+# VOLUME GENERATIONS
+#
+# Each openedx-dev image gets its own "generation" of ALL_NAMED_VOLUMES, named
+# after the image's ID. When the image changes (because it was rebuilt or pulled),
+# the next `tutor dev start` creates a fresh generation of volumes, populated from
+# the new image. Switching back to a recently-used image is instant, since its
+# generation of volumes is still around. The least-recently-used generations are
+# deleted once there are more than QUICKDEV_MAX_GENERATIONS of them, or once they
+# take up more than QUICKDEV_MAX_GENERATIONS_SIZE megabytes (0 means no limit).
+# The generation is a suffix of each volume's key in the compose files, so the name of
+# each volume is "<project>_<volume>_<generation>".
+# If the image isn't available locally when the compose files are rendered (or
+# Docker can't be reached), then the volumes get no suffix at all. These form the
+# "" generation, which is deleted as soon as a generation named after an image
+# is in use, since we can't tell which image its volumes were populated from.
+
+
+@functools.lru_cache(maxsize=None)
+def image_generation(image: str) -> str:
+    """
+    Get the short ID of a local Docker image, or "" if it isn't available locally.
+    """
+    try:
+        image_id = DockerClient().image_id(image)
+    except (OSError, DockerApiError):
+        return ""
+    return (image_id or "").split(":")[-1][:12]
+
+
+def volume_key(
+    config: t.Mapping[str, t.Any], volume_name: str, generation: t.Optional[str] = None
+) -> str:
+    """
+    Get the key of one of our volumes in the `tutor dev` compose files.
+
+    Unless otherwise specified, the generation is that of the current openedx-dev image.
+    """
+    if volume_name in ALL_NAMED_VOLUMES and config["QUICKDEV_IMAGE_GENERATIONS"]:
+        if generation is None:
+            generation = image_generation(config["DOCKER_IMAGE_OPENEDX_DEV"])
+        if generation:
+            return f"{volume_name}_{generation}"
+    return volume_name
+
+
+def docker_volume_name(
+    config: t.Mapping[str, t.Any], volume_name: str, generation: t.Optional[str] = None
+) -> str:
+    """
+    Get the actual Docker name of one of our `tutor dev` volumes, which Compose
+    prefixes with the project name.
+    """
+    return f"{config['DEV_PROJECT_NAME']}_{volume_key(config, volume_name, generation)}"
+
+
+def populate_single_asset_volume(config: t.Mapping[str, t.Any]) -> None:
+    """
+    Create the single asset volume, populated from the image, unless it already exists.
+
+    Docker populates an empty volume when it creates a container which mounts it, so
+    we create (but don't start) a throwaway container. It mounts each of our named
+    volumes at its path, so that none of the image's VOLUMEs gets an anonymous volume,
+    which would be populated only to be deleted. Those which don't exist yet are
+    created first, labelled the way Compose would label them, so that Compose
+    adopts them rather than warning about them.
+    """
+    client = DockerClient()
+    asset_volume_name = docker_volume_name(config, "openedx_static_assets")
+    if client.volume_exists(asset_volume_name):
+        return
+    volumes = named_volumes(config)
+    with tracing.span("populate volumes", volumes=list(volumes)):
+        for volume_name in volumes:
+            name = docker_volume_name(config, volume_name)
+            if name == asset_volume_name or not client.volume_exists(name):
+                client.create_volume(
+                    name,
+                    {
+                        "com.docker.compose.project": config["DEV_PROJECT_NAME"],
+                        "com.docker.compose.volume": volume_key(config, volume_name),
+                    },
+                )
+        container_id = client.create_container(
+            config["DOCKER_IMAGE_OPENEDX_DEV"],
+            [
+                f"{docker_volume_name(config, volume_name)}:{container_path}"
+                for volume_name, container_path in volumes.items()
+            ],
+        )
+        client.remove_container(container_id)
+
+
+def load_config(root: str) -> dict[str, t.Any]:
+    """
+    Load the full config of a project.
+    """
+    # pylint: disable=import-outside-toplevel
+    from tutor import config as tutor_config
+
+    return tutor_config.load(root)
+
+
+def delete_volumes(config: dict[str, t.Any], volume_names: t.Iterable[str]) -> None:
+    """
+    Stop containers & delete one or more named `tutor dev` volumes.
+
+    Only the containers that actually use the volumes are stopped & removed (this
+    includes `tutor dev run` containers), so that unrelated services such as MySQL
+    and Mongo keep running.
+    """
+    # I don't know of a way to delete specific volumes through docker-compose,
+    # so we must build the volume names ourselves, the same way that we named
+    # them in the compose file.
+    docker_volume_names = [
+        docker_volume_name(config, volume_name) for volume_name in volume_names
+    ]
+    try:
+        with tracing.span("delete volumes", volumes=docker_volume_names):
+            deleted = DockerClient().remove_volumes_and_their_containers(
+                docker_volume_names
+            )
+    except (OSError, DockerApiError) as exc:
+        raise click.ClickException(f"Failed to delete volumes: {exc}")
+    for name in docker_volume_names:
+        if name in deleted:
+            click.echo(f"Deleted volume {name}.")
+        else:
+            click.echo(f"Volume {name} did not exist.")
+
+
+def delete_generation(config: dict[str, t.Any], generation: str) -> bool:
+    """
+    Delete all volumes of a generation, in parallel. Return whether that succeeded.
+    """
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    click.echo(
+        "Deleting least-recently-used volume generation "
+        f"{generation or '(unsuffixed)'}..."
+    )
+    client = DockerClient()
+    with ThreadPoolExecutor() as executor:
+        futures = [
+            executor.submit(
+                client.remove_volume,
+                docker_volume_name(config, volume_name, generation),
+            )
+            for volume_name in ALL_NAMED_VOLUMES
+        ]
+    try:
+        for future in futures:
+            future.result()
+    except (OSError, DockerApiError) as exc:
+        # Some volumes are still in use (status 409), so keep track
+        # of the generation in order to try again later.
+        click.echo(
+            f"Could not delete generation {generation or '(unsuffixed)'}: {exc}",
+            err=True,
+        )
+        return False
+    return True
+
+
+def _generations_path(root: str) -> str:
+    # pylint: disable=import-outside-toplevel
+    from tutor import env as tutor_env
+
+    return tutor_env.data_path(root, "quickdev", "generations.json")
+
+
+def load_generations(root: str) -> dict[str, float]:
+    """
+    Load the last-used timestamp of each generation of volumes.
+    """
+    try:
+        with open(_generations_path(root), encoding="utf-8") as generations_file:
+            return json.load(generations_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_generations(root: str, last_used: dict[str, float]) -> None:
+    """
+    Save the last-used timestamp of each generation of volumes.
+    """
+    path = _generations_path(root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as generations_file:
+        json.dump(last_used, generations_file)
+
+
+def generation_sizes(
+    config: dict[str, t.Any], generations_: t.Iterable[str]
+) -> dict[str, int]:
+    """
+    Get the total disk usage, in bytes, of each generation of volumes.
+
+    If Docker can't be reached, then every generation is reported as empty.
+    """
+    try:
+        volume_sizes = DockerClient().volume_sizes()
+    except (OSError, DockerApiError) as exc:
+        click.echo(f"Could not get the sizes of volumes: {exc}", err=True)
+        volume_sizes = {}
+    return {
+        generation: sum(
+            volume_sizes.get(docker_volume_name(config, volume_name, generation), 0)
+            for volume_name in ALL_NAMED_VOLUMES
+        )
+        for generation in generations_
+    }